@@ -0,0 +1,121 @@
+from __future__ import unicode_literals
+#
+# columns.py
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import time
+
+import logging
+log = logging.getLogger(__name__)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# filter functions computed as columns, see core.filter_funcs
+COLUMN_FUNCS = [
+    'func_ratio',
+    'func_added',
+    'func_seed_time',
+    'func_seeders',
+    'func_availability',
+    'func_time_since_transfer',
+    'func_time_seen_complete'
+]
+
+if numpy is not None:
+    sel_masks = {
+        'and': numpy.logical_and,
+        'or': numpy.logical_or,
+        'xor': numpy.logical_xor
+    }
+
+
+def available():
+    return numpy is not None
+
+
+def _number(value):
+    return float('nan') if value is None else value
+
+
+class Columns(object):
+    """The snapshots of a list of (torrent_id, snapshot) as typed columns,
+    one per filter function plus the flags the rules need.
+
+    Values match the filter functions: times are rounded to 2 decimals and
+    the time since transfer and since seen complete are 0 where the filter
+    functions return False. Missing values are NaN, so every comparison
+    with them is False.
+    """
+
+    def __init__(self, torrents, now=None):
+        now = time.time() if now is None else now
+        snapshots = [s for (i, s) in torrents]
+        count = len(snapshots)
+
+        def column(values, dtype=float):
+            return numpy.fromiter(values, dtype=dtype, count=count)
+
+        self.values = {
+            'func_ratio': column(_number(s['ratio']) for s in snapshots),
+            'func_added': numpy.round(
+                (now - column(_number(s['time_added']) for s in snapshots)) / 86400.0, 2
+            ),
+            'func_seed_time': numpy.round(
+                column(_number(s['seeding_time']) for s in snapshots) / 3600.0, 2
+            ),
+            'func_seeders': column(_number(s['total_seeds']) for s in snapshots),
+            'func_availability': column(_number(s['distributed_copies']) for s in snapshots),
+            'func_time_since_transfer': numpy.round(
+                column(s['time_since_transfer'] or 0 for s in snapshots) / 3600.0, 2
+            )
+        }
+        seen_complete = column(s.get('last_seen_complete') or 0 for s in snapshots)
+        self.values['func_time_seen_complete'] = numpy.where(
+            seen_complete > 0, numpy.round((now - seen_complete) / 3600.0, 2), 0.0
+        )
+        self.is_finished = column((bool(s['is_finished']) for s in snapshots), bool)
+
+    def get(self, func_name):
+        """Returns the column of a filter function, ratio for unknown ones
+        like filter_funcs does"""
+        return self.values.get(func_name, self.values['func_ratio'])
+
+    def order(self, filter1, filter2):
+        """Indices sorted by (filter1, filter2) ascending, ties in list order"""
+        return numpy.lexsort((self.get(filter2), self.get(filter1)))
+
+    def row(self, index):
+        """The filter values of one torrent as python numbers"""
+        return dict((func_name, self.values[func_name][index].item()) for func_name in COLUMN_FUNCS)
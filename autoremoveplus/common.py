@@ -42,3 +42,21 @@ from __future__ import unicode_literals
 def get_resource(filename):
     import pkg_resources, os
     return pkg_resources.resource_filename("autoremoveplus", os.path.join("data", filename))
+
+def format_scan_stats(scans):
+    """Returns the breakdown of the last of scans, as returned by the
+    get_scan_stats() RPC, as lines of text"""
+    import time
+    if not scans:
+        return ["No check has run yet."]
+    scan = scans[-1]
+    lines = ["Last {} check at {}, took {:.3f} s".format(
+        scan['kind'],
+        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(scan['started'])),
+        scan['duration']
+    )]
+    for phase in scan['phases']:
+        lines.append("    {}: {:.3f} s ({} calls)".format(phase['name'], phase['time'], phase['calls']))
+    for name in sorted(scan['counts']):
+        lines.append("    {}: {}".format(name, scan['counts'][name]))
+    return lines
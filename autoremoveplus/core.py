@@ -48,11 +48,22 @@ from deluge.plugins.pluginbase import CorePluginBase
 import deluge.component as component
 import deluge.configmanager
 from deluge.core.rpcserver import export
-from .mediaserver import Mediaserver
-from twisted.internet import reactor
-from twisted.internet.task import LoopingCall, deferLater
-
+from .mediaserver import AsyncMediaserver
+from .matcher import TorrentMatcher
+from .labels import LabelIndex
+from .statestore import StateStore
+from .scanstats import ScanStats, ScanTimer
+from .plan import ScanPlan
+from .scheduler import ScanScheduler
+from . import columns
+from .columns import numpy
+from twisted.internet import defer, reactor
+from twisted.internet.task import LoopingCall, Cooperator, SchedulerStopped
+
+import os
 import time
+import math
+import heapq
 import logging
 log = logging.getLogger(__name__)
 
@@ -82,42 +93,68 @@ DEFAULT_PREFS = {
     "pause_seed": False,  
     "seedtime_limit": 120,
     "seedtime_pause": 48,
-    "pause_torrents": False    
+    "pause_torrents": False,
+    "queue_ttl": 60,
+    "queue_page_size": 250,
+    "queue_workers": 4,
+    "server_pool_size": 10,
+    "tick_interval": 5,
+    "mount_hdd_space": {},
+    "scan_engine": "auto",
+    "scan_chunk_time": 0.05
 }
 
-def _get_ratio(i_t):
-    (i, t) = i_t
-    log.debug("Get ratio: i = {}, t = {}".format(i,t))
-    return t.get_ratio()
-
-def _time_last_transfer(i_t):
-    (i, t) = i_t
+# Status keys fetched once per torrent per scan, see Core.get_snapshots().
+# Everything the filter functions, rules and logging need must be listed here.
+SNAPSHOT_KEYS = [
+    'name',
+    'hash',
+    'ratio',
+    'time_added',
+    'seeding_time',
+    'total_seeds',
+    'distributed_copies',
+    'time_since_transfer',
+    'last_seen_complete',
+    'is_finished',
+    'paused',
+    'state',
+    'total_size',
+    'save_path',
+    'trackers'
+]
+
+# Filter functions take an (id, snapshot) tuple, where snapshot is the status
+# dict returned by Core.get_snapshots() for that torrent
+def _get_ratio(i_s):
+    (i, s) = i_s
+    log.debug("Get ratio: i = {}, ratio = {}".format(i,s['ratio']))
+    return s['ratio']
+
+def _time_last_transfer(i_s):
+    (i, s) = i_s
     try:
         # time since last transfer (upload/download) in hours
-        time_since_last_transfer = round(t.get_status(['time_since_transfer'])['time_since_transfer'] / 3600.0,2)
+        time_since_last_transfer = round(s['time_since_transfer'] / 3600.0,2)
     except Exception as e:
         log.error("Unable to get torrent property:{}".format(e))
         return False
     
     return time_since_last_transfer
 
-def _age_in_days(i_t):
-    (i, t) = i_t
+def _age_in_days(i_s):
+    (i, s) = i_s
     now = time.time()
-    added = t.get_status(['time_added'])['time_added']
+    added = s['time_added']
     log.debug("Now = {}, added = {}".format(now,added))
     age_in_days = round((now - added)/86400.0,2) # age in days
     log.debug("Returning age: {}".format(age_in_days))
     return age_in_days
 
-def _time_seen_complete(i_t):
-    (i, t) = i_t
+def _time_seen_complete(i_s):
+    (i, s) = i_s
     now = time.time()
-    try:
-      seen_complete = t.get_status(['last_seen_complete'])['last_seen_complete']
-    except Exception as e:
-      log.error("Unable to get torrent property:{}".format(e))
-      return False
+    seen_complete = s.get('last_seen_complete')
       
     if not seen_complete: return False
     
@@ -130,13 +167,145 @@ def _time_seen_complete(i_t):
 filter_funcs = {
     'func_ratio': _get_ratio,
     'func_added': _age_in_days,
-    'func_seed_time': lambda p: round(p[1].get_status(['seeding_time'])['seeding_time'] / 3600.0,2),
-    'func_seeders': lambda p: p[1].get_status(['total_seeds'])['total_seeds'],
-    'func_availability': lambda p: p[1].get_status(['distributed_copies'])['distributed_copies'],
+    'func_seed_time': lambda p: round(p[1]['seeding_time'] / 3600.0,2),
+    'func_seeders': lambda p: p[1]['total_seeds'],
+    'func_availability': lambda p: p[1]['distributed_copies'],
     'func_time_since_transfer': _time_last_transfer,
     'func_time_seen_complete': _time_seen_complete    
 }
 
+# Filter functions that grow with the clock alone, with their unit in seconds
+time_funcs = {
+    'func_added': 86400.0,
+    'func_seed_time': 3600.0,
+    'func_time_since_transfer': 3600.0,
+    'func_time_seen_complete': 3600.0
+}
+
+class MetricCache(object):
+    """Filter function values of one scan, computed lazily and keyed by
+    (torrent_id, func_name) so sorting, general rules and specific rules
+    share them"""
+
+    def __init__(self, snapshots):
+        self.snapshots = snapshots
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+        # time spent computing values
+        self.seconds = 0.0
+
+    def get(self, i, func_name):
+        key = (i, func_name)
+        try:
+            value = self.values[key]
+        except KeyError:
+            self.misses += 1
+            start = time.time()
+            value = filter_funcs.get(func_name, _get_ratio)((i, self.snapshots[i]))
+            self.seconds += time.time() - start
+            self.values[key] = value
+        else:
+            self.hits += 1
+        return value
+
+# torrents decided on between two checks of the chunk time budget
+SCAN_STEP = 100
+
+# seconds without config changes before the check they trigger runs
+CONFIG_SCAN_DELAY = 5.0
+
+def _cooperative(steps, timer):
+    """Wraps the steps of a decision for the Cooperator, the time between
+    steps is spent on the reactor and counted as idle by timer"""
+    for step in steps:
+        paused = time.time()
+        yield step
+        timer.idle += time.time() - paused
+
+def _select_candidates(torrents, count, metrics, filter1, filter2):
+    """Yields the count torrents with the highest (filter1, filter2) values,
+    highest first, in the order of reversed(sorted(torrents)[-count:]).
+
+    Only filter1 is computed for every torrent, filter2 only for torrents
+    that share their filter1 value with others. The ordering is lazy, so a
+    caller that stops early leaves the rest of the heap untouched. Yields
+    None after every SCAN_STEP torrents put on the heap or tied on filter1"""
+    if count <= 0:
+        return
+    heap = []
+    for index, (i, s) in enumerate(torrents):
+        if index and not index % SCAN_STEP:
+            yield None
+        heapq.heappush(heap, (-metrics.get(i, filter1), index, i, s))
+    while heap and count > 0:
+        group = [heapq.heappop(heap)]
+        while heap and heap[0][0] == group[0][0]:
+            if not len(group) % SCAN_STEP:
+                yield None
+            group.append(heapq.heappop(heap))
+        if len(group) > 1:
+            # ties on filter1 are broken by filter2, then by list order
+            keyed = []
+            for n, entry in enumerate(group):
+                if n and not n % SCAN_STEP:
+                    yield None
+                keyed.append(((metrics.get(entry[2], filter2), entry[1]), entry))
+            keyed.sort(reverse=True)
+            group = [entry for key, entry in keyed]
+        for entry in group[:count]:
+            yield (entry[2], entry[3])
+        count -= len(group)
+
+def _advance_snapshot(s, elapsed):
+    """Returns a copy of snapshot s as it would be elapsed seconds later,
+    assuming only the clock has moved since it was taken"""
+    s = dict(s)
+    if s['time_since_transfer'] is not None:
+        s['time_since_transfer'] += elapsed
+    if s['state'] == 'Seeding' and s['seeding_time'] is not None:
+        s['seeding_time'] += elapsed
+    return s
+
+def _mount_point(path):
+    """Returns the mount point of the filesystem path is on"""
+    path = os.path.realpath(path)
+    while not os.path.ismount(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+# Seconds of slack added to deadlines, filter values are rounded
+DEADLINE_SLACK = 60.0
+
+# Deadline functions return the time at which a filter function reaches limit,
+# assuming only the clock moves, or None if it never does on its own. Filter
+# functions without one here do not change with time.
+def _added_deadline(s, limit, now):
+    return s['time_added'] + limit * 86400.0
+
+def _seed_time_deadline(s, limit, now):
+    if s['state'] != 'Seeding':
+        return None
+    return now + limit * 3600.0 - s['seeding_time']
+
+def _last_transfer_deadline(s, limit, now):
+    return now + limit * 3600.0 - s['time_since_transfer']
+
+def _seen_complete_deadline(s, limit, now):
+    if not s.get('last_seen_complete'):
+        return None
+    return s['last_seen_complete'] + limit * 3600.0
+
+deadline_funcs = {
+    'func_added': _added_deadline,
+    'func_seed_time': _seed_time_deadline,
+    'func_time_since_transfer': _last_transfer_deadline,
+    'func_time_seen_complete': _seen_complete_deadline
+}
+
 sel_funcs = {
     'and': lambda tup: tup[0] and tup[1],
     'or': lambda tup: tup[0] or tup[1],
@@ -152,22 +321,26 @@ class Core(CorePluginBase):
             "autoremoveplus.conf",
             DEFAULT_PREFS
         )
-        self.torrent_states = deluge.configmanager.ConfigManager(
-            "autoremoveplusstates.conf",
-            {}
+        # ids of ignored torrents, written behind, see StateStore
+        self.torrent_states = StateStore(
+            "autoremoveplus.ignored",
+            "autoremoveplusstates.conf"
         )
 
         # Safe after loading to have a default configuration if no gtkui
         self.config.save()
-        self.torrent_states.save()
 
         # it appears that if the plugin is enabled on boot then it is called
         # before the torrents are properly loaded and so periodicScan receives an
         # empty list. So we must listen to SessionStarted for when deluge boots
         #  but we still have apply_now so that if the plugin is enabled
         # mid-program periodicScan is still run
-        self.looping_call = LoopingCall(self.periodicScan)
-        deferLater(reactor, 5, self.start_looping)
+        self.looping_call = LoopingCall(self.request_scan, False)
+        # between full scans, only torrents that changed are looked at
+        self.tick_call = LoopingCall(self.request_scan, True)
+        # one check at a time, checks requested meanwhile run once after it
+        self.scheduler = ScanScheduler(self._run_scan)
+        self.start_call = reactor.callLater(5, self.start_looping)
         try:
           apikey_sonarr = self.config['api_sonarr']
           apikey_radarr = self.config['api_radarr']
@@ -188,22 +361,218 @@ class Core(CorePluginBase):
           
         log.debug("Server config: Sonarr: enabled={},key={}, Radarr: enabled={}, key={}, Lidarr: enabled={}, key={}, Server: url={}".format(use_sonarr,apikey_sonarr,use_radarr,apikey_radarr,use_lidarr,apikey_lidarr,server))
         
-        self.sonarr = Mediaserver(server,apikey_sonarr,'sonarr')
-        self.lidarr = Mediaserver(server,apikey_lidarr,'lidarr')
-        self.radarr = Mediaserver(server,apikey_radarr,'radarr')  
+        # queues are cached for queue_ttl seconds, so a scan fetches each queue once
+        queue_ttl = self.config['queue_ttl']
+        page_size = self.config['queue_page_size']
+        workers = self.config['queue_workers']
+        pool_size = self.config['server_pool_size']
+        self.sonarr = AsyncMediaserver(server,apikey_sonarr,'sonarr',queue_ttl,page_size,workers,pool_size)
+        self.lidarr = AsyncMediaserver(server,apikey_lidarr,'lidarr',queue_ttl,page_size,workers,pool_size)
+        self.radarr = AsyncMediaserver(server,apikey_radarr,'radarr',queue_ttl,page_size,workers,pool_size)
         self.accepted_labels = ['tv-sonarr','radarr','lidarr']
         self.torrentmanager = component.get("TorrentManager")
-                       
+        # status keys the running deluge version supports
+        self.snapshot_keys = list(SNAPSHOT_KEYS)
+        self.compile_matcher()
+
+        # snapshots of the last scan, updated incrementally between full scans
+        self.snapshot_cache = {}
+        self.snapshot_times = {}
+        # torrents changed since their snapshot was taken
+        self.dirty_torrents = set()
+        # (filter, filter2) key of the lowest candidate of the last full
+        # scan, None when it had none. Incremental scans rank by it, aged
+        # by the time since cutoff_time
+        self.cutoff = None
+        self.cutoff_time = 0.0
+        # torrents removed since the last full scan, other than by the checks
+        self.cutoff_removals = 0
+        # torrents the running check is removing
+        self.removing = set()
+        # decisions run in chunks of at most scan_chunk_time seconds, so
+        # the reactor keeps serving RPC and events during long scans
+        self.cooperator = Cooperator(
+            terminationPredicateFactory=self._chunk_deadline,
+            scheduler=lambda work: reactor.callLater(0, work)
+        )
+        # (time, torrent_id) heap of the next time based rule crossings
+        self.deadlines = []
+        # current deadline of each torrent, heap entries that differ are stale
+        self.deadline_times = {}
+        self.deadline_call = None
+        # mount point of each save path, cleared on every full scan
+        self.mounts = {}
+        # timings of the last scans, see get_scan_stats()
+        self.scan_stats = ScanStats()
+
+        # the Label plugin has no events, labels are read once per scan
+        # instead, see LabelIndex
+        self.event_handlers = {
+            'TorrentAddedEvent': self.on_torrent_changed,
+            'TorrentFinishedEvent': self.on_torrent_changed,
+            'TorrentStateChangedEvent': self.on_torrent_changed,
+            'TorrentResumedEvent': self.on_torrent_changed,
+            'TorrentRemovedEvent': self.on_torrent_removed,
+            'SessionStartedEvent': self.prune_states
+        }
+        for event, handler in self.event_handlers.items():
+            component.get("EventManager").register_event_handler(event, handler)
+
+        # enabled mid-session, the torrents are already loaded
+        if self.torrentmanager.get_state() == 'Started':
+            self.prune_states()
+
     def disable(self):
+        if self.start_call.active():
+            self.start_call.cancel()
         if self.looping_call.running:
             self.looping_call.stop()
+        if self.tick_call.running:
+            self.tick_call.stop()
+        if self.deadline_call and self.deadline_call.active():
+            self.deadline_call.cancel()
+        self.scheduler.stop()
+        self.cooperator.stop()
+        for event, handler in self.event_handlers.items():
+            component.get("EventManager").deregister_event_handler(event, handler)
+        self.torrent_states.flush()
 
     def update(self):
         pass
 
     def start_looping(self):
         log.info('check interval loop starting')
+        if self.looping_call.running:
+            self.looping_call.stop()
         self.looping_call.start(self.config['interval'] * 3600.0)
+        self.start_ticking()
+
+    def start_ticking(self):
+        if self.tick_call.running:
+            self.tick_call.stop()
+        # tick_interval is in minutes, 0 turns incremental checks off
+        if self.config['tick_interval'] > 0:
+            self.tick_call.start(self.config['tick_interval'] * 60.0, now=False)
+
+    def _chunk_deadline(self):
+        """Returns the predicate ending a chunk of decisions once its
+        scan_chunk_time seconds are up"""
+        deadline = time.time() + float(self.config['scan_chunk_time'])
+        return lambda: time.time() >= deadline
+
+    def on_torrent_changed(self, torrent_id, *args):
+        self.dirty_torrents.add(torrent_id)
+
+    def on_torrent_removed(self, torrent_id):
+        self.snapshot_cache.pop(torrent_id, None)
+        self.snapshot_times.pop(torrent_id, None)
+        self.dirty_torrents.discard(torrent_id)
+        self.deadline_times.pop(torrent_id, None)
+        if torrent_id not in self.removing:
+            self.cutoff_removals += 1
+        if self.torrent_states.pop(torrent_id):
+            self.torrent_states.save()
+
+    def prune_states(self):
+        """Forgets ignored torrents that were removed while we were not looking"""
+        pruned = self.torrent_states.prune(self.torrentmanager.get_torrent_list())
+        log.debug("Pruned {} ignored torrents that no longer exist".format(pruned))
+        self.torrent_states.save()
+
+    def schedule_deadlines(self, torrents, torrent_rules, partial=False):
+        """Rebuilds the deadline heap from the time based thresholds each
+        torrent can still cross, and wakes up at the earliest one. Partial
+        only replaces the deadlines of torrents.
+
+        Deadlines are rounded up to buckets of the tick interval, or
+        DEADLINE_SLACK without ticks, so nearby crossings share a wake up"""
+        for step in self._deadline_steps(torrents, torrent_rules, partial):
+            pass
+
+    def _deadline_steps(self, torrents, torrent_rules, partial):
+        """Schedules the deadlines like schedule_deadlines(), yielding
+        every SCAN_STEP torrents"""
+        now = time.time()
+        spacing = max(DEADLINE_SLACK, self.config['tick_interval'] * 60.0)
+        thresholds = []
+        if self.config['rule_2_enabled']:
+            thresholds.append((self.config['filter2'], float(self.config['min2'])))
+        seed_thresholds = [
+            ('func_seed_time', float(self.config['seedtime_limit'])),
+            ('func_seed_time', float(self.config['seedtime_pause']))
+        ]
+
+        if not partial:
+            self.deadlines = []
+            self.deadline_times = {}
+        for n, (i, s) in enumerate(torrents):
+            if n and not n % SCAN_STEP:
+                yield
+            # entries left in the heap for it are stale from here
+            self.deadline_times.pop(i, None)
+            chain = torrent_rules.get(i)
+            rules = [(step[1], step[2]) for step in chain.steps] if chain else []
+            checks = rules or thresholds
+            if s['is_finished']:
+                checks = checks + seed_thresholds
+            when = None
+            for func_name, limit in checks:
+                func = deadline_funcs.get(func_name)
+                if not func:
+                    continue
+                try:
+                    crossing = func(s, float(limit), now)
+                except (TypeError, ValueError):
+                    continue
+                if crossing is not None and crossing > now and (when is None or crossing < when):
+                    when = crossing
+            if when is not None:
+                when = math.ceil((when + DEADLINE_SLACK) / spacing) * spacing
+                self.deadline_times[i] = when
+                if partial:
+                    heapq.heappush(self.deadlines, (when, i))
+                else:
+                    self.deadlines.append((when, i))
+
+        if not partial:
+            heapq.heapify(self.deadlines)
+        log.debug("Scheduled {} deadlines".format(len(self.deadline_times)))
+        self.arm_deadline()
+
+    def arm_deadline(self):
+        if self.deadline_call and self.deadline_call.active():
+            self.deadline_call.cancel()
+        self.deadline_call = None
+        # drop the stale entries on top of the heap
+        while self.deadlines and self.deadline_times.get(self.deadlines[0][1]) != self.deadlines[0][0]:
+            heapq.heappop(self.deadlines)
+        if self.deadlines:
+            delay = max(self.deadlines[0][0] - time.time(), 1.0)
+            self.deadline_call = reactor.callLater(delay, self.on_deadline)
+
+    def on_deadline(self):
+        """Marks the torrents whose deadline has passed as changed, so an
+        incremental check refreshes and evaluates only them"""
+        self.deadline_call = None
+        now = time.time()
+        due = []
+        while self.deadlines:
+            when, i = self.deadlines[0]
+            if self.deadline_times.get(i) != when:
+                # replaced by a later decision
+                heapq.heappop(self.deadlines)
+                continue
+            if when > now:
+                break
+            heapq.heappop(self.deadlines)
+            del self.deadline_times[i]
+            due.append(i)
+        log.debug("AutoRemovePlus: {} torrents reached a time threshold".format(len(due)))
+        self.dirty_torrents.update(due)
+        self.arm_deadline()
+        if due and self.snapshot_cache:
+            # the incremental check schedules their next deadlines
+            return self.scheduler.request(True)
 
     @export
     def set_config(self, config):
@@ -211,15 +580,38 @@ class Core(CorePluginBase):
         for key in list(config.keys()):
             self.config[key] = config[key]
         self.config.save()
+        self.compile_matcher()
+        # the ranking of the last full scan is for the old rules
+        self.cutoff = None
+        for server in (self.sonarr, self.radarr, self.lidarr):
+            server.configure(
+                self.config['queue_ttl'],
+                self.config['queue_page_size'],
+                self.config['queue_workers'],
+                self.config['server_pool_size']
+            )
+        if self.start_call.active():
+            # the loops start with a check of their own shortly
+            return
         if self.looping_call.running:
             self.looping_call.stop()
-        self.looping_call.start(self.config['interval'] * 3600.0)
+        self.looping_call.start(self.config['interval'] * 3600.0, now=False)
+        self.start_ticking()
+        # saving preferences several times in a row runs a single check,
+        # once they stop changing
+        self.scheduler.request_later(CONFIG_SCAN_DELAY)
 
     @export
     def get_config(self):
         """Returns the config dictionary"""
         return self.config.config
 
+    @export
+    def get_scan_stats(self):
+        """Returns the phase timings and counters of the last scans, oldest
+        first"""
+        return self.scan_stats.get()
+
     @export
     def get_remove_rules(self):
         return {
@@ -237,7 +629,7 @@ class Core(CorePluginBase):
         if not hasattr(torrent_ids, '__iter__'):
             torrent_ids = [torrent_ids]
 
-        return [self.torrent_states.config.get(t, False) for t in torrent_ids]
+        return [self.torrent_states.get(t, False) for t in torrent_ids]
 
     @export
     def set_ignore(self, torrent_ids, ignore=True):
@@ -254,65 +646,216 @@ class Core(CorePluginBase):
 
         self.torrent_states.save()
 
-    def blacklistTorrent(self, i, t, label_str, name):
-        hash = t.get_status(['hash'])['hash'].upper()    
-                
+    def get_snapshots(self, torrent_ids):
+        """Returns {torrent_id: status} with all SNAPSHOT_KEYS of each torrent,
+        fetched with a single get_status call per torrent"""
+        snapshots = {}
+        for i in torrent_ids:
+            t = self.torrentmanager.torrents.get(i, None)
+            if not t:
+                log.warning("No torrent object for: {}".format(i))
+                continue
+            try:
+                snapshots[i] = t.get_status(self.snapshot_keys)
+            except Exception as e:
+                # older deluge versions lack some keys (e.g. time_since_transfer),
+                # find them once and leave them out of the remaining calls
+                log.debug("Batched status failed for {}: {}".format(i,e))
+                snapshots[i] = self._get_status_by_key(i, t)
+            for key in SNAPSHOT_KEYS:
+                snapshots[i].setdefault(key, None)
+        return snapshots
+
+    def _get_status_by_key(self, i, t):
+        status = {}
+        for key in list(self.snapshot_keys):
+            try:
+                status[key] = t.get_status([key])[key]
+            except KeyError as e:
+                log.warning("Torrent property {} not supported, skipping it from now on: {}".format(key,e))
+                self.snapshot_keys.remove(key)
+            except Exception as e:
+                log.error("Unable to get torrent property {} for {}: {}".format(key,i,e))
+        return status
+
+    def store_snapshots(self, snapshots):
+        now = time.time()
+        self.snapshot_cache.update(snapshots)
+        for i in snapshots:
+            self.snapshot_times[i] = now
+        self.dirty_torrents.difference_update(snapshots)
+
+    def update_snapshots(self):
+        """Refreshes the cached snapshots of the torrents that changed since
+        they were taken, and returns the refreshed snapshots"""
+        refresh = [i for i in self.dirty_torrents if i in self.torrentmanager.torrents]
+        snapshots = self.get_snapshots(refresh)
+        self.store_snapshots(snapshots)
+        # torrents that are gone are not dirty anymore either
+        self.dirty_torrents.clear()
+        log.debug("Refreshed {} snapshots".format(len(snapshots)))
+        return snapshots
+
+    def cached_snapshots(self, torrent_ids):
+        """Returns the cached snapshots of torrent_ids moved forward to the
+        current time"""
+        now = time.time()
+        snapshots = {}
+        for i in torrent_ids:
+            if i in self.snapshot_cache:
+                snapshots[i] = _advance_snapshot(self.snapshot_cache[i], now - self.snapshot_times[i])
+        return snapshots
+
+    @export
+    def preview_scan(self):
+        """Returns the plan a scan would carry out now, as a list of entries
+        (see ScanPlan), without acting on it. Works from the snapshot cache,
+        only changed and new torrents are read and the cache is left as is"""
+        max_seeds = int(self.config['max_seeds'])
+        torrent_ids = self.torrentmanager.get_torrent_list()
+        if max_seeds < 0 or len(torrent_ids) <= max_seeds:
+            return []
+
+        cached, refresh = [], []
+        for i in torrent_ids:
+            if i in self.dirty_torrents or i not in self.snapshot_cache:
+                refresh.append(i)
+            else:
+                cached.append(i)
+        snapshots = self.cached_snapshots(cached)
+        snapshots.update(self.get_snapshots(refresh))
+
+        d = self._decide(snapshots, schedule=False)
+        d.addCallback(lambda plan: plan.entries if plan else [])
+        return d
+
+    def get_queues(self):
+        """Returns a Deferred firing with {server type: queue} of the enabled servers"""
+        servers = [
+            server for server, use in (
+                (self.sonarr, self.config['enable_sonarr']),
+                (self.radarr, self.config['enable_radarr']),
+                (self.lidarr, self.config['enable_lidarr'])
+            ) if use
+        ]
+        d = defer.gatherResults([server.get_queue() for server in servers], consumeErrors=True)
+        d.addCallback(lambda queues: dict(zip([server.type for server in servers], queues)))
+        return d
+
+    def get_labels(self, torrent_ids):
+        """Returns a LabelIndex of torrent_ids, None if the Label plugin is
+        not available"""
+        try:
+            return LabelIndex(component.get("CorePlugin.Label"), torrent_ids)
+        except Exception as e:
+            log.warning("Cannot obtain torrent labels: {}".format(e))
+            return None
+
+    def blacklistTorrent(self, i, s, label_str, name, plan, rule='blacklist request', metrics=None):
+        """Adds a torrent to the blacklist targets of its server in plan. The
+        queue items are looked up and deleted by flush_blacklist()"""
+
         if label_str and label_str in self.accepted_labels:
             mediaObject = self.sonarr if label_str == 'tv-sonarr' else self.radarr if label_str == 'radarr' else self.lidarr
         elif not label_str:
             log.warning("No label for {}".format(name))
-            return
+            return False
         else:
             log.warning("Unknown label for torrrent {}".format(name))
-            return
+            return False
         
-        if mediaObject:
-            mediaList = mediaObject.get_queue()
-            log.debug("Size of media list: {}".format(len(mediaList)))
+        isFinished = s['is_finished']
+        remove_data = self.config['seed_remove_data'] if isFinished else self.config['remove_data']
+        plan.blacklist(mediaObject.type, i, s, remove_data, rule, metrics)
+        return True
+
+    def flush_blacklist(self, targets, removals, timer=None):
+        """Deletes the collected queue items with one bulk request per server
+        and adds their torrents to removals. Returns a Deferred firing with the
+        number of torrents added"""
+        servers = {'sonarr': self.sonarr, 'radarr': self.radarr, 'lidarr': self.lidarr}
+        pending = []
+        started = time.time()
+
+        for server_type, entries in targets.items():
+            # the queue is only fetched when there is something to blacklist
+            d = servers[server_type].get_queue()
+            if timer:
+                timer.timed(d, 'queues')
+            d.addCallback(self._delete_queued, servers[server_type], entries, removals, started)
+            d.addErrback(self._blacklist_failed, server_type)
+            pending.append(d)
+
+        d = defer.gatherResults(pending)
+        d.addCallback(sum)
+        return d
+
+    def _delete_queued(self, mediaList, mediaObject, entries, removals, started=None):
+        log.debug("Size of media list: {}".format(len(mediaList)))
+        if started is not None and mediaObject.queue_fetched() < started and \
+                any(hash not in mediaList for (i, hash, name, isFinished, remove_data) in entries):
+            # the cached queue may predate a grab, never remove a torrent
+            # without blacklisting it because of an old queue
+            log.debug("Torrents missing from the cached {} queue, fetching it again".format(mediaObject.type))
+            mediaObject.invalidate_queue()
+            d = mediaObject.get_queue()
+            d.addCallback(self._delete_queued, mediaObject, entries, removals)
+            return d
+
+        queued = []
+        for (i, hash, name, isFinished, remove_data) in entries:
             if hash in mediaList:
                 id = str(mediaList[hash].get('id'))
                 log.info("hash: {}, id: {},type = {}".format(hash,id,type(id)))
-                
-                #blacklist from PVR
-                response = mediaObject.delete_queueitem(id)
-                changed = True
-                log.info("Blacklist request for torrent {} returned {}".format(name,response))
-                
-                isFinished = t.get_status(['is_finished'])['is_finished']
-                remove_data = self.config['seed_remove_data'] if isFinished else self.config['remove_data']
-                
-                #remove from deluge
-                result = self.remove_torrent(i,remove_data)
-                log.info("Removing {} torrent {} {} data returned: {}".format('unfinished' if not isFinished else 'finished', name, 'with' if remove_data else 'without', result))
-                    
-                return result
             else:
                 log.warning("Could not blacklist torrent {}: not in server queue: {}".format(name, hash))
-                log.debug("List: {}".format(mediaList))
-                
-                isFinished = t.get_status(['is_finished'])['is_finished']
-                remove_data = self.config['seed_remove_data'] if isFinished else self.config['remove_data']
-                
-                #remove from deluge
-                result = self.remove_torrent(i,remove_data)
-                log.info("Removing {} torrent {} {} data. Result: {}".format('unfinished' if not isFinished else 'finished', name, 'with' if remove_data else 'without', result))
-                
-                return result
-        else:
-            log.warning("Upstream server not found for label: {}".format(label_str))
-            return
+                id = None
+            queued.append((i, id, name, isFinished, remove_data))
+
+        ids = [id for (i, id, name, isFinished, remove_data) in queued if id is not None]
+        log.info("Blacklisting {} items on {}".format(len(ids),mediaObject.type))
+        #blacklist from PVR
+        d = mediaObject.delete_queueitems(ids) if ids else defer.succeed([])
+        d.addCallback(self._remove_blacklisted, queued, removals)
+        return d
+
+    def _remove_blacklisted(self, deleted, entries, removals):
+        deleted = set(deleted)
+        removed = 0
+        for (i, id, name, isFinished, remove_data) in entries:
+            if id is not None and id not in deleted:
+                log.warning("Not removing torrent {}: blacklist request for item {} failed".format(name,id))
+                continue
+            #remove from deluge
+            removals[remove_data].append(i)
+            log.info("Removing {} torrent {} {} data".format('unfinished' if not isFinished else 'finished', name, 'with' if remove_data else 'without'))
+            removed += 1
+        return removed
+
+    def _blacklist_failed(self, failure, server_type):
+        log.error("Error blacklisting torrents on {}: {}".format(server_type,failure.getErrorMessage()))
+        return 0
             
     @export
     def blacklistCommand(self, torrent_ids):
         log.info("blacklistCommand torrent running for {}".format(torrent_ids))
-        
+        # a check acting on the same torrents must not run at the same time
+        return self.scheduler.run_exclusive(self._blacklist_command, torrent_ids)
+
+    def _blacklist_command(self, torrent_ids):
+        d = self.get_queues()
+        d.addCallback(self._blacklist_torrents, torrent_ids)
+        d.addErrback(lambda failure: log.error("Error getting server queues: {}".format(failure.getErrorMessage())))
+        return d
+
+    def _blacklist_torrents(self, queues, torrent_ids):
         use_sonarr = self.config['enable_sonarr'] if self.config['enable_sonarr'] else False
         use_radarr = self.config['enable_radarr'] if self.config['enable_radarr'] else False
         use_lidarr = self.config['enable_lidarr'] if self.config['enable_lidarr'] else False
           
-        sonarr_list = self.sonarr.get_queue() if use_sonarr else {}
-        radarr_list = self.radarr.get_queue() if use_radarr else {}
-        lidarr_list = self.lidarr.get_queue() if use_lidarr else {}
+        sonarr_list = queues.get('sonarr', {})
+        radarr_list = queues.get('radarr', {})
+        lidarr_list = queues.get('lidarr', {})
         try:
             total_size = len(sonarr_list) + len(lidarr_list) + len(radarr_list)
             log.info("Size of lists: sonarr:{}, lidarr:{}, radarr:{}".format(len(sonarr_list),len(lidarr_list),len(radarr_list)))
@@ -325,46 +868,65 @@ class Core(CorePluginBase):
             return
             
         label_str = None
-        blackListedNum = 0
+        plan = ScanPlan()
                 
         if not hasattr(torrent_ids, '__iter__'):
             torrent_ids = [torrent_ids]
 
+        snapshots = self.get_snapshots(torrent_ids)
+        labels = self.get_labels(snapshots)
+
         for i in torrent_ids:
-            t = self.torrentmanager.torrents.get(i, None)
-            log.debug("i = {}, t = {}, types = {}/{}".format(i,t,type(i),type(t)))
-            if not t:
-                log.warning("No torrent object for: {}".format(i))
+            s = snapshots.get(i, None)
+            log.debug("i = {}, types = {}".format(i,type(i)))
+            if not s:
                 continue
             else: 
-                name = t.get_status(['name'])['name']
+                name = s['name']
                 
                 if not name:
                     log.warning("Skipping blacklisting of torrent {}: could not get name".format(i))
                     continue
                 else:
-                    #try:
-                    label_str = component.get("CorePlugin.Label")._status_get_label(i)
+                    label_str = labels.get(i) if labels is not None else None
                     if label_str and label_str in self.accepted_labels:
                         if (label_str == 'tv-sonarr' and use_sonarr) or (label_str == 'radarr' and use_radarr) or (label_str == 'lidarr' and use_lidarr):
-                            result = self.blacklistTorrent(i,t,label_str,name)
-                            if result:
-                                blackListedNum += 1
-                            log.info("Blacklist request returned: {}".format(result))
+                            self.blacklistTorrent(i,s,label_str,name,plan)
                         else:
                             log.info("Blacklisting not enabled for  {}".format(label_str))
-                    #except Exception as e:
-                    #   log.warning("Error getting label for torrent {}: {}".format(name,e))
-                    #   continue
-                           
-        self.torrent_states.save()
-        return blackListedNum
+
+        def done(removed):
+            log.info("Blacklist requests removed {} torrents".format(len(removed)))
+            self.torrent_states.save()
+            return len(removed)
+
+        d = self.flush_blacklist(plan.targets, plan.removals)
+        d.addCallback(lambda blacklisted: self.execute_actions([], plan.removals))
+        d.addCallback(done)
+        return d
         
-    def check_min_space(self):
-        min_hdd_space = self.config['hdd_space']
-        real_hdd_space = component.get("Core").get_free_space() / 1073741824.0
+    def get_mount(self, save_path):
+        try:
+            return self.mounts[save_path]
+        except KeyError:
+            mount = _mount_point(save_path) if save_path else None
+            self.mounts[save_path] = mount
+            return mount
 
-        log.debug("Space: %s/%s" % (real_hdd_space, min_hdd_space))
+    def get_free_space(self, mount=None):
+        """Free space of the filesystem mounted on mount in GiB, of the
+        download location if mount is None"""
+        return component.get("Core").get_free_space(mount) / 1073741824.0
+
+    def get_min_space(self, mount):
+        """Minimum free space of mount in GiB, from mount_hdd_space or else
+        hdd_space"""
+        return float(self.config['mount_hdd_space'].get(mount, self.config['hdd_space']))
+
+    def check_min_space(self, real_hdd_space, mount=None):
+        min_hdd_space = self.get_min_space(mount)
+
+        log.debug("Space on %s: %s/%s" % (mount, real_hdd_space, min_hdd_space))
 
         # if deactivated delete torrents
         if min_hdd_space < 0.0:
@@ -376,79 +938,232 @@ class Core(CorePluginBase):
         else:
             return False
 
+    def reclaim_space(self, free_space, under_target, mount, s):
+        """Adds the size of a torrent removed with data to the projected free
+        space of its mount"""
+        free_space[mount] += (s['total_size'] or 0) / 1073741824.0
+        if self.check_min_space(free_space[mount], mount):
+            under_target.discard(mount)
+
     def pause_torrent(self, torrent):
         try:
             torrent.pause()
         except Exception as e:
             log.warning("AutoRemovePlus: Problems pausing torrent: {}".format(e))
 
-    def remove_torrent(self, tid, remove_data):
-        log.debug("Running remove_torrent: {} with remove data = {}".format(tid,remove_data))
-        try:
-            self.torrentmanager.remove(tid, remove_data=remove_data)
-        except Exception as e:
-            log.warning("AutoRemovePlus: Error removing torrent {}: {}".format(tid,e))
-        try:
-            del self.torrent_states.config[tid]
-        except KeyError:
-            log.warning("AutoRemovePlus: no saved state for torrent {}".format(tid))
-            return True
-        except Exception as e:
-            log.warning("AutoRemovePlus: Error deleting state for torrent {}: {}".format(tid, e))
-            return False
-        else:
-            return True
-
-    def get_torrent_rules(self, id, torrent, tracker_rules, label_rules):
-        
-        total_rules = []
+    def execute_actions(self, pauses, removals):
+        """Pauses the torrent ids in pauses, then removes the ones in
+        removals ({remove_data: [torrent ids]}) with one bulk call per
+        remove_data value. Returns a Deferred firing with the removed ids.
+        The torrent states are updated but not saved"""
+        for tid in pauses:
+            torrent = self.torrentmanager.torrents.get(tid, None)
+            if torrent:
+                self.pause_torrent(torrent)
+
+        pending = []
+        for remove_data, torrent_ids in removals.items():
+            if not torrent_ids:
+                continue
+            log.debug("Removing {} torrents with remove data = {}".format(len(torrent_ids),remove_data))
+            # deluge saves its session state once per call
+            d = component.get("Core").remove_torrents(torrent_ids, remove_data)
+            d.addCallback(self._removed, torrent_ids)
+            pending.append(d)
+
+        d = defer.gatherResults(pending)
+        d.addCallback(lambda removed: [tid for torrent_ids in removed for tid in torrent_ids])
+        return d
+
+    def _removed(self, errors, torrent_ids):
+        failed = set()
+        for tid, error in errors:
+            log.warning("AutoRemovePlus: Error removing torrent {}: {}".format(tid,error))
+            failed.add(tid)
+        removed = [tid for tid in torrent_ids if tid not in failed]
+        for tid in removed:
+            self.torrent_states.pop(tid, None)
+        return removed
+
+    def compile_matcher(self):
+        self.matcher = TorrentMatcher(
+            self.config['trackers'],
+            self.config['labels'],
+            self.config['tracker_rules'],
+            self.config['label_rules'],
+            sel_funcs
+        )
 
-        try:
-          for t in torrent.trackers:
-              for name, rules in list(tracker_rules.items()):
-                  log.debug("Get_torrent_rules: processing name = {}, rules = {}, url = {}, find = {} ".format(name, rules,t['url'],t['url'].find(name.lower())))
-                  if(t['url'].find(name.lower()) != -1):
-                      for rule in rules:
-                          total_rules.append(rule)
-        except Exception as e:
-          log.warning("Get_torrent_rules: Exception with getting torrent rules for {}: {}".format(id,e))
-          return total_rules
-          
-        if label_rules:
-            try:
-                # get label string
-                label_str = component.get(
-                    "CorePlugin.Label"
-                )._status_get_label(id)
-
-                # if torrent has labels check them
-                labels = [label_str] if len(label_str) > 0 else []
-
-                for label in labels:
-                    if label in label_rules:
-                        for rule in label_rules[label]:
-                            total_rules.append(rule)
-            except Exception as e:
-                log.warning("Cannot obtain torrent label for {}: {}".format(id,e))
-        log.debug("Get_torrent_rules: returning rules for {}: {}".format(id,total_rules))
-        return total_rules
+    def request_scan(self, incremental=False):
+        """Requests a full or incremental check for the looping calls,
+        without returning its Deferred: a LoopingCall restarted while
+        waiting on one would end up running twice"""
+        if incremental:
+            self.tick()
+        else:
+            self.periodicScan()
 
     # we don't use args or kwargs it just allows callbacks to happen cleanly
     def periodicScan(self, *args, **kwargs):
+        """Requests a full scan, returns a Deferred firing when it is done"""
         log.info("AutoRemovePlus: Running check. Interval is {} minutes".format(round(self.config['interval'] * 60.0,1)))
-        
+        return self.scheduler.request(False)
+
+    def tick(self):
+        """Incremental check between full scans, only the snapshots of
+        torrents that changed are refreshed"""
+        if not self.snapshot_cache:
+            # nothing to build on before the first full scan
+            return
+        log.debug("AutoRemovePlus: Running incremental check, {} torrents changed".format(len(self.dirty_torrents)))
+        return self.scheduler.request(True)
+
+    def _run_scan(self, incremental, counts=None):
+        """Runs a scan for the scheduler, counts are the requests it covers"""
+        timer = ScanTimer('incremental' if incremental else 'full')
+        for name, n in (counts or {}).items():
+            timer.count(name, n)
+        if not incremental:
+            self.mounts = {}
+
+        def finished(result):
+            self.scan_stats.record(timer)
+            return result
+
+        def failed(failure):
+            # a failed scan must not stop the looping call
+            if failure.check(SchedulerStopped):
+                log.info("AutoRemovePlus: Check stopped, the plugin is disabled")
+            else:
+                log.error("Error running scan: {}".format(failure.getErrorMessage()))
+            return False
+
+        d = defer.maybeDeferred(self._scan, incremental, timer)
+        d.addErrback(failed)
+        d.addBoth(finished)
+        return d
+
+    def _scan(self, incremental=False, timer=None):
+        """Decides what to pause and remove, then does it. Incremental scans
+        only refresh and decide on the torrents that changed, placed in the
+        ranking of the last full scan"""
+        if timer is None:
+            timer = ScanTimer('incremental' if incremental else 'full')
+        max_seeds = int(self.config['max_seeds'])
+
+        # Negative max means unlimited seeds are allowed, so don't do anything
+        if max_seeds < 0:
+            return
+
+        torrent_ids = self.torrentmanager.get_torrent_list()
+
+        log.info("Number of torrents: {0}".format(len(torrent_ids)))
+
+        # If there are less torrents present than we allow
+        # then there can be nothing to do
+        timer.count('torrents', len(torrent_ids))
+        if len(torrent_ids) <= max_seeds:
+            return
+
+        if incremental and self.cutoff is not None and self.cutoff_removals > 0:
+            # with fewer torrents some of the candidates of the full scan
+            # are needed to keep max_seeds
+            log.debug("AutoRemovePlus: Torrents were removed since the last full check")
+            self.cutoff = None
+
+        if incremental and self.cutoff is None:
+            # no ranking to place changed torrents in, the next full scan
+            # looks at them
+            return
+
+        with timer.phase('snapshots'):
+            if incremental:
+                snapshots = self.update_snapshots()
+                timer.count('status_calls', len(snapshots))
+            else:
+                # one status call per torrent, every filter below reads from this
+                snapshots = self.get_snapshots(torrent_ids)
+                self.store_snapshots(snapshots)
+                self.cutoff_removals = 0
+                timer.count('status_calls', len(torrent_ids))
+        if not snapshots:
+            return
+
+        def act(plan):
+            if plan is None:
+                return
+            # torrents removed by the user while deciding are left alone
+            plan = plan.restrict(self.torrentmanager.torrents)
+            plan.log()
+            pauses, removals, targets = plan.pauses, plan.removals, plan.targets
+
+            def done(removed):
+                log.info("AutoRemovePlus: paused {} and removed {} torrents".format(len(pauses),len(removed)))
+                timer.count('paused', len(pauses))
+                timer.count('removed', len(removed))
+                self.removing.clear()
+                # If a torrent exemption state has been removed save changes
+                if removed:
+                    with timer.phase('save'):
+                        self.torrent_states.save()
+
+            def remove(blacklisted):
+                # these leave the ranking of the full scan as it is
+                self.removing.update(i for torrent_ids in removals.values() for i in torrent_ids)
+                return timer.timed(self.execute_actions(pauses, removals), 'actions')
+
+            d = timer.timed(self.flush_blacklist(targets, removals, timer), 'blacklist')
+            d.addCallback(remove)
+            d.addCallback(done)
+            return d
+
+        def prune(plan):
+            # every torrent was just matched, forget the trackers and labels
+            # of the torrents that are gone
+            dropped = self.matcher.prune()
+            log.debug("Dropped {} cached tracker/label matches".format(dropped))
+            return plan
+
+        d = self._decide(snapshots, timer, partial=incremental)
+        if not incremental:
+            d.addCallback(prune)
+        d.addCallback(act)
+        return d
+
+    def _decide(self, snapshots, timer=None, schedule=True, partial=False):
+        """Returns a Deferred firing with the ScanPlan for snapshots, None if
+        there is nothing to do. Acts on nothing, but schedules the time based
+        deadlines and keeps the ranking for partial decisions unless schedule
+        is False.
+
+        snapshots are those of all torrents, or with partial those of the
+        torrents that changed, which are only candidates if they rank above
+        the cutoff of the last full decision.
+
+        The decisions run on the reactor in chunks of scan_chunk_time
+        seconds, see _decide_steps()"""
+        if timer is None:
+            timer = ScanTimer('decision')
+        plans = []
+        steps = _cooperative(self._decide_steps(snapshots, timer, schedule, partial, plans), timer)
+        d = self.cooperator.coiterate(steps)
+        d.addCallback(lambda steps: plans[0] if plans else None)
+        return d
+
+    def _decide_steps(self, snapshots, timer, schedule, partial, plans):
+        """Decides on snapshots and appends the ScanPlan to plans, unless
+        there is nothing to do. Yields every SCAN_STEP torrents, so the
+        Cooperator can hand the reactor back in between"""
+        start = timer.clock()
         try:
           max_seeds = int(self.config['max_seeds'])
           count_exempt = self.config['count_exempt']
           remove_data = self.config['remove_data']
           seed_remove_data = self.config['seed_remove_data']
-          exemp_trackers = self.config['trackers']
-          exemp_labels = self.config['labels']
           min_val = float(self.config['min'])
           max_val2 = float(self.config['min2'])
           remove = self.config['remove']
           enabled = self.config['enabled']
-          tracker_rules = self.config['tracker_rules']
           rule_1_chk = self.config['rule_1_enabled']
           rule_2_chk = self.config['rule_2_enabled']
           seedtime_limit = float(self.config['seedtime_limit'])
@@ -459,256 +1174,456 @@ class Core(CorePluginBase):
           use_radarr = self.config['enable_radarr'] if self.config['enable_radarr'] else False
           use_lidarr = self.config['enable_lidarr'] if self.config['enable_lidarr'] else False
           
-          sonarr_list = self.sonarr.get_queue() if use_sonarr else {}
-          radarr_list = self.radarr.get_queue() if use_radarr else {}
-          lidarr_list = self.lidarr.get_queue() if use_lidarr else {}
-          
           #prevent hit & run
           #seedtime_pause = seedtime_pause if seedtime_pause > 20.0 else 20.0
           #seedtime_limit = seedtime_limit if seedtime_limit > 24.0 else 24.0
           
           log.debug("Using sonarr: {}, radarr: {}, lidarr: {}".format(use_sonarr,use_radarr,use_lidarr))
-          log.info("Size of lists: sonarr:{}, lidarr:{}, radarr:{}".format(len(sonarr_list),len(lidarr_list),len(radarr_list)))
-                   
-          #response = self.sonarr.delete_queueitem('1771649588')          
-          #log.info("Delete response:{}".format(response))
           
         except Exception as e:
           log.error("Error reading config: {}".format(e))
-          return False
+          return
+        timer.add('config', timer.clock() - start)
         
         if 'Label' in component.get(
             "CorePluginManager"
         ).get_enabled_plugins():
             labels_enabled = True
-            label_rules = self.config['label_rules']
         else:
             log.warning("WARNING! Label plugin not active")
             log.debug("No labels will be checked for exemptions!")
-            label_rules = []
-
-        # Negative max means unlimited seeds are allowed, so don't do anything
-        if max_seeds < 0:
-            return
-
-        torrent_ids = self.torrentmanager.get_torrent_list()
-
-        log.info("Number of torrents: {0}".format(len(torrent_ids)))
-
-        # If there are less torrents present than we allow
-        # then there can be nothing to do
-        if len(torrent_ids) <= max_seeds:
-            return
 
         torrents = []
         ignored_torrents = []
+        # specific tracker/label rules of each torrent
+        torrent_rules = {}
 
-        # relevant torrents to us exist and are finished
-        for i in torrent_ids:
-            t = self.torrentmanager.torrents.get(i, None)
-      
-            try:
-                ignored = self.torrent_states[i]
-            except KeyError as e:
-                ignored = False
+        start = timer.clock()
+        # labels are only checked if Label plugin is enabled
+        labels = self.get_labels(snapshots) if labels_enabled else None
+        # torrents with an exempted label are skipped as a group
+        exempt_labelled = labels.exempt_torrents(self.matcher) if labels is not None else set()
 
-            ex_torrent = False
-            trackers = t.trackers
+        # relevant torrents to us exist and are finished
+        for n, (i, s) in enumerate(snapshots.items()):
+            if n and not n % SCAN_STEP:
+                yield
+            if i in self.torrent_states or i in exempt_labelled:
+                ignored_torrents.append((i, s))
+                continue
 
-            # check if trackers in exempted tracker list
-            for tracker, ex_tracker in (
-                (t, ex_t) for t in trackers for ex_t in exemp_trackers
-            ):
-                if(tracker['url'].find(ex_tracker.lower()) != -1):
-                    log.debug("Found exempted tracker: %s" % (ex_tracker))
-                    ex_torrent = True
+            label_str = labels.get(i) if labels is not None else None
 
-            # check if labels in exempted label list if Label plugin is enabled
-            if labels_enabled:
-                try:
-                    # get label string
-                    label_str = component.get(
-                        "CorePlugin.Label"
-                    )._status_get_label(i)
-
-                    # if torrent has labels check them
-                    labels = [label_str] if len(label_str) > 0 else []
-
-                    for label, ex_label in (
-                        (l, ex_l) for l in labels for ex_l in exemp_labels
-                    ):
-                        if(label.find(ex_label.lower()) != -1):
-                            log.debug("Found exempted label: %s" % (ex_label))
-                            ex_torrent = True
-                except Exception as e:
-                    log.warning("Cannot obtain torrent label: {}".format(e))
+            # check if trackers or label in the exemption lists, and get the
+            # specific rules of both
+            ex_torrent, torrent_rules[i] = self.matcher.match(s['trackers'], label_str)
 
-            # if torrent tracker or label in exemption list, or torrent ignored
-            # insert in the ignored torrents list
-            (ignored_torrents if ignored or ex_torrent else torrents)\
-                .append((i, t))
+            # if torrent tracker or label in exemption list insert in the
+            # ignored torrents list
+            (ignored_torrents if ex_torrent else torrents).append((i, s))
 
+        timer.add('exemptions', timer.clock() - start)
         log.info("Number of ignored torrents: {0}".format(len(ignored_torrents)))
 
-        # now that we have trimmed active torrents
-        # check again to make sure we still need to proceed
-        if len(torrents) +\
-                (len(ignored_torrents) if count_exempt else 0) <= max_seeds:
-            return
-
-        # if we are counting ignored torrents towards our maximum
-        # then these have to come off the top of our allowance
-        if count_exempt:
-            max_seeds -= len(ignored_torrents)
-            if max_seeds < 0:
-                max_seeds = 0
+        # the cutoff of the last full decision is kept for partial ones
+        ranking = {} if schedule and not partial else None
+
+        if partial:
+            if enabled and schedule:
+                # only these torrents were refreshed, the others keep theirs
+                for i, s in ignored_torrents:
+                    self.deadline_times.pop(i, None)
+                with timer.phase('deadlines'):
+                    for step in self._deadline_steps(torrents, torrent_rules, True):
+                        yield step
+            if self.cutoff is None:
+                return
+            torrents = self.ranked(torrents, snapshots)
+            max_seeds = 0
+        else:
+            # now that we have trimmed active torrents
+            # check again to make sure we still need to proceed
+            if len(torrents) +\
+                    (len(ignored_torrents) if count_exempt else 0) <= max_seeds:
+                if schedule:
+                    self.cutoff = None
+                    self.schedule_deadlines([], torrent_rules)
+                return
+
+            if enabled and schedule:
+                with timer.phase('deadlines'):
+                    for step in self._deadline_steps(torrents, torrent_rules, False):
+                        yield step
+
+            # if we are counting ignored torrents towards our maximum
+            # then these have to come off the top of our allowance
+            if count_exempt:
+                max_seeds -= len(ignored_torrents)
+                if max_seeds < 0:
+                    max_seeds = 0
  
-        # Alternate sort by primary and secondary criteria
-        torrents.sort(
-            key=lambda x: (
-                filter_funcs.get(
-                    self.config['filter'],
-                    _get_ratio
-                )(x),
-                filter_funcs.get(
-                    self.config['filter2'],
-                    _get_ratio
-                )(x)
-            ),
-            reverse=False
-        )
+        plan = ScanPlan()
+
+        # the general rules, as shown in plans
+        general_rules = []
+        if rule_1_chk:
+            general_rules.append("{} <= {}".format(self.config['filter'], min_val))
+        if rule_2_chk:
+            general_rules.append("{} >= {}".format(self.config['filter2'], max_val2))
+        general_rule = " {} ".format(self.config['sel_func']).join(general_rules)
+
+        # free space is read once per mount, removals with data add their
+        # size to it as deluge deletes the files in the background
+        start = timer.clock()
+        free_space = {}
+        for n, (i, s) in enumerate(torrents):
+            if n and not n % SCAN_STEP:
+                yield
+            mount = self.get_mount(s['save_path'])
+            if mount not in free_space:
+                free_space[mount] = self.get_free_space(mount)
+        # mounts that still need space
+        under_target = set(mount for mount in free_space if not self.check_min_space(free_space[mount], mount))
+        log.debug("Mounts under target: {}".format(sorted(under_target, key=str)))
+        timer.add('free_space', timer.clock() - start, len(free_space))
+
+        if not enabled:
+            if ranking is not None:
+                self.cutoff = None
+            plans.append(plan)
+            return
 
-        changed = False
+        # candidates with their rule results, highest first. Partial
+        # decisions are on a few torrents, columns do not pay off there
+        if self.use_columns() and not partial:
+            decisions = self._column_decisions(torrents, max_seeds, torrent_rules, general_rule, timer, ranking)
+        else:
+            decisions = self._python_decisions(torrents, max_seeds, torrent_rules, general_rule, snapshots, under_target, timer, ranking)
 
+        start, measured = timer.clock(), timer.total()
         # remove or pause these torrents
-        for i, t in reversed(torrents[max_seeds:]):
-            name = t.get_status(['name'])['name']
-            log.debug("Now processing name = {}, type = {}".format(name,type(name)))
+        for item in decisions:
+            if item is None:
+                # the engine finished a step
+                yield
+                continue
+            i, s, decision = item
             # check if free disk space below minimum
-            if self.check_min_space():
+            if not under_target:
                 break  # break the loop, we have enough space
-                
-            if enabled:
+            name = s['name']
+            log.debug("Now processing name = {}, type = {}".format(name,type(name)))
+            mount = self.get_mount(s['save_path'])
+            if mount not in under_target:
+                continue  # enough space on this torrent's disk
+
+            remove_cond, seed_remove_cond, specific_rules, rule_str, values = decision
+            seedtime = values['func_seed_time'] #seed time in hours
+            isFinished = s['is_finished']
+            paused = s['paused']
+
+            if values['func_time_seen_complete']:
+                log.debug("Processing torrent: {}, last transfer: {} h, last seen complete: {} h, paused: {}".format(name,values['func_time_since_transfer'],values['func_time_seen_complete'],paused))
+
+            if not isFinished:
+                if labels is not None:
+                    label_str = labels.get(i)
+                    if not label_str:
+                        log.warning("Torrent: {}, label = {}".format(name,label_str))
+                else:
+                    label_str = 'none'
+                log.debug("Processing unfinished torrent {}, label = {}".format(name,label_str))
+                if remove_cond:
+                    #pause torrents if selected
+                    if pause_torrents:
+                        if not paused:
+                            log.debug("AutoRemovePlus: Pausing torrent {} due to availability = {}, age = {}, time_last_transfer = {}".format(name, values['func_availability'], values['func_added'], values['func_time_since_transfer']))
+                            plan.pause(i, s, rule_str, values)
+
+                    #user has selected to remove torrents
+                    if remove:
+                        if remove_data:
+                            self.reclaim_space(free_space, under_target, mount, s)
+                        blacklisted = False
+                        # blacklist, the torrent is removed when the targets are flushed
+                        if label_str and label_str in self.accepted_labels:
+                            if (label_str == 'tv-sonarr' and use_sonarr) or (label_str == 'radarr' and use_radarr) or (label_str == 'lidarr' and use_lidarr):
+                                blacklisted = self.blacklistTorrent(i,s,label_str,name,plan,rule_str,values)
+                        else:
+                            log.warning("No matching label {} for torrent {}".format(label_str,name))
+
+                        if not blacklisted:
+                            # remove using local method
+                            plan.remove(i, s, remove_data, rule_str, values)
+                            log.debug("AutoRemovePlus: removing unfinished torrent {} with data = {} using internal method".format(name,remove_data))
+
+            else: # is finished
+
+              log.debug("Fin.: {}, seed time:{}/{}, ratio: {}, spec. rules = {}, sr cond. = {}/{},isfinished = {}".format(name,seedtime,seedtime_limit,values['func_ratio'],specific_rules,remove_cond,seed_remove_cond,isFinished))
+              if (not specific_rules) or (seed_remove_cond):
+                #remove condition
+                if seedtime > seedtime_limit:
+                    #seed_remove_data decides if user wants data removed or not
+                    plan.remove(i, s, seed_remove_data, "seed time > {} h".format(seedtime_limit), values)
+                    if seed_remove_data:
+                        self.reclaim_space(free_space, under_target, mount, s)
+                    log.debug("AutoRemovePlus: removing torrent from seed: {} due to seed time = {}/{} h".format(name,seedtime,seedtime_limit))
+
+                #pause condition
+                elif seedtime > seedtime_pause:
+                    if pause_torrents:
+                        if not paused:
+                          plan.pause(i, s, "seed time > {} h".format(seedtime_pause), values)
+                          log.debug("AutoRemovePlus: pausing finished torrent {} with seedtime = {}/{} h, ratio = {}, rules = {}, sr-cond = {}/{}".format(name,seedtime,seedtime_pause,values['func_ratio'],specific_rules,remove_cond,seed_remove_cond))
+                        else:
+                          log.debug("AutoRemovePlus: torrent is already paused: {}".format(name))
+
+        # let the decisions record their phases before the rest is counted
+        decisions.close()
+        if ranking is not None:
+            self.cutoff = ranking.get('cutoff')
+            self.cutoff_time = ranking.get('time', 0.0)
+        timer.add('rules', timer.clock() - start - (timer.total() - measured))
+
+        plans.append(plan)
+
+    def ranked(self, torrents, snapshots):
+        """Returns the torrents ranking as candidates by the cutoff of the
+        last full scan. The time based parts of the cutoff are aged like
+        the torrents that did not change since"""
+        metrics = MetricCache(snapshots)
+        filter1, filter2 = self.config['filter'], self.config['filter2']
+        elapsed = time.time() - self.cutoff_time
+        cutoff = tuple(
+            value + elapsed / time_funcs[func_name] if func_name in time_funcs else value
+            for value, func_name in zip(self.cutoff, (filter1, filter2))
+        )
+        return [
+            (i, s) for i, s in torrents
+            if (metrics.get(i, filter1), metrics.get(i, filter2)) >= cutoff
+        ]
+
+    def use_columns(self):
+        """Whether scans use the columnar engine, scan_engine is 'auto'
+        (columnar when numpy is installed), 'numpy' or 'python'"""
+        engine = self.config['scan_engine']
+        if engine == 'python':
+            return False
+        if not columns.available():
+            if engine == 'numpy':
+                log.warning("AutoRemovePlus: numpy is not installed, using the python scan engine")
+            return False
+        return True
+
+    def _python_decisions(self, torrents, max_seeds, torrent_rules, general_rule, snapshots, under_target, timer, ranking=None):
+        """Yields (torrent_id, snapshot, decision) for the candidates above
+        max_seeds, highest first, evaluating one torrent at a time. Yields
+        None after every SCAN_STEP torrents. Sets the 'cutoff' of ranking to
+        the (filter, filter2) key of the lowest candidate"""
+        min_val = float(self.config['min'])
+        max_val2 = float(self.config['min2'])
+        rule_1_chk = self.config['rule_1_enabled']
+        rule_2_chk = self.config['rule_2_enabled']
+
+        if ranking is not None:
+            # the keys are computed from here on
+            ranking['time'] = time.time()
+        metrics = MetricCache(snapshots)
+        # Torrents above max_seeds, by primary and secondary criteria,
+        # highest first
+        candidates = _select_candidates(
+            torrents,
+            len(torrents) - max_seeds,
+            metrics,
+            self.config['filter'],
+            self.config['filter2']
+        )
+
+        # time spent ordering candidates, and computing keys while at it
+        selection = [0.0, 0.0]
+
+        def timed(candidates):
+            while True:
+                start, keys = time.time(), metrics.seconds
+                try:
+                    candidate = next(candidates)
+                except StopIteration:
+                    return
+                finally:
+                    selection[0] += time.time() - start
+                    selection[1] += metrics.seconds - keys
+                yield candidate
+
+        try:
+            candidates = timed(candidates)
+            # the last candidate selected so far
+            lowest = None
+            for n, candidate in enumerate(candidates):
+                if candidate is None:
+                    # the selection finished a step
+                    yield None
+                    continue
+                if n and not n % SCAN_STEP:
+                    yield None
+                i, s = candidate
+                lowest = i
+                if not under_target:
+                    break
+                if self.get_mount(s['save_path']) not in under_target:
+                    continue
+
                 # Get result of first condition test
-                filter_1 = filter_funcs.get(self.config['filter'], _get_ratio)((i, t)) <= min_val
+                filter_1 = metrics.get(i, self.config['filter']) <= min_val
                 # Get result of second condition test
-                
+
                 #chosen_func = self.config['filter2']
                 # prevent hit and runs
                 #max_val2 = max_val2 if max_val2 > 0.5 else 0.5
                 #log.info("Chosen filter2 : {}, cut-off: {}".format(chosen_func,max_val2))
-                
-                filter_2 = filter_funcs.get(self.config['filter2'], _get_ratio)((i, t)) >= max_val2
 
-                specific_rules = self.get_torrent_rules(i, t, tracker_rules, label_rules)
+                filter_2 = metrics.get(i, self.config['filter2']) >= max_val2
 
-                # Sort rules according to logical operators, AND is evaluated first
-                specific_rules.sort(key=lambda rule: rule[0])
+                specific_rules = torrent_rules[i]
+                log.debug("Specific rules for {}: {}".format(s['name'],specific_rules))
 
                 remove_cond = False
                 seed_remove_cond  = False #for removing finished torrents
 
                 # If there are specific rules, ignore general remove rules
                 if specific_rules:
-                    remove_cond = filter_funcs.get(specific_rules[0][1])((i,t)) \
-                        >= specific_rules[0][2]
-                    for rule in specific_rules[1:]:
-                        check_filter = filter_funcs.get(rule[1])((i,t)) \
-                            >= rule[2]
-                        remove_cond = sel_funcs.get(rule[0])((
-                            check_filter,
-                            remove_cond
-                        ))
+                    rule_str = specific_rules.description
+                    remove_cond = specific_rules.evaluate(
+                        lambda func_name: metrics.get(i, func_name)
+                    )
                     seed_remove_cond = remove_cond
-                elif rule_1_chk and rule_2_chk:
-                    # If both rules active use custom logical function
-                    remove_cond = sel_funcs.get(self.config['sel_func'])((
-                        filter_1,
-                        filter_2
-                    ))
-                elif rule_1_chk and not rule_2_chk:
-                    # Evaluate only first rule, since the other is not active
-                    remove_cond = filter_1
-                elif not rule_1_chk and rule_2_chk:
-                    # Evaluate only second rule, since the other is not active
-                    remove_cond = filter_2
+                else:
+                    rule_str = general_rule
+                    if rule_1_chk and rule_2_chk:
+                        # If both rules active use custom logical function
+                        remove_cond = sel_funcs.get(self.config['sel_func'])((
+                            filter_1,
+                            filter_2
+                        ))
+                    elif rule_1_chk and not rule_2_chk:
+                        # Evaluate only first rule, since the other is not active
+                        remove_cond = filter_1
+                    elif not rule_1_chk and rule_2_chk:
+                        # Evaluate only second rule, since the other is not active
+                        remove_cond = filter_2
 
                 # If logical functions are satisfied remove or pause torrent
                 # add check that torrent is not completed
                 try:
-                    name = t.get_status(['name'])['name']
-                    age = _age_in_days((i,t)) # age in days
-                    seedtime = round(t.get_status(['seeding_time'])['seeding_time']/3600,2) #seed time in hours
-                    ratio = t.get_status(['ratio'])['ratio']
-                    availability = t.get_status(['distributed_copies'])['distributed_copies']
-                    time_last_transfer = _time_last_transfer((i,t)) # in hours
-                    time_seen_complete = _time_seen_complete((i,t)) #seen complete in hours
-                    isFinished = t.get_status(['is_finished'])['is_finished']
-                    paused = t.get_status(['paused'])['paused']
-                    hash = t.get_status(['hash'])['hash'].upper()                    
+                    values = {
+                        'func_added': metrics.get(i, 'func_added'), # age in days
+                        'func_seed_time': metrics.get(i, 'func_seed_time'), #seed time in hours
+                        'func_ratio': metrics.get(i, 'func_ratio'),
+                        'func_availability': metrics.get(i, 'func_availability'),
+                        'func_time_since_transfer': metrics.get(i, 'func_time_since_transfer'), # in hours
+                        'func_time_seen_complete': metrics.get(i, 'func_time_seen_complete') #seen complete in hours
+                    }
                 except Exception as e:
                     log.error("Error with torrent: {}".format(e))
                     continue
-                if time_seen_complete:
-                    log.debug("Processing torrent: {}, last transfer: {} h, last seen complete: {} h, paused: {}".format(name,time_last_transfer,time_seen_complete,paused))
-                
-                if not isFinished:
-                    try:
-                        label_str = component.get("CorePlugin.Label")._status_get_label(i)
-                        if not label_str:
-                            log.warning("Torrent: {}, label = {}".format(name,label_str))
-                    except Exception as e:
-                        log.error("Error getting label for torrent {}: {}".format(name,e))
-                        label_str = 'none'
-                    log.debug("Processing unfinished torrent {}, label = {}".format(name,label_str))
-                    if remove_cond:
-                        #pause torrents if selected
-                        if pause_torrents:
-                            if not paused:
-                                log.info("AutoRemovePlus: Pausing torrent {} due to availability = {}, age = {}, time_last_transfer = {}".format(name, availability, age,time_last_transfer))
-                                self.pause_torrent(t)
-                                
-                        #user has selected to remove torrents
-                        if remove:
-                            # blacklist
-                            if label_str and label_str in self.accepted_labels:
-                                if (label_str == 'tv-sonarr' and use_sonarr) or (label_str == 'radarr' and use_radarr) or (label_str == 'lidarr' and use_lidarr):
-                                    result = self.blacklistTorrent(i,t,label_str,name)
-                                    log.info("Blacklist request for {} returned: {}".format(name,result))
-                            else:
-                                log.warning("No matching label {} for torrent {}".format(label_str,name))
-                                
-                            # remove using local method
-                            result = self.remove_torrent(i, remove_data)
-                            log.info("AutoRemovePlus: removing unfinished torrent {} with data = {} using internal method: {}".format(name,remove_data, result))                            
-                        
-                            
-
-                else: # is finished
-                    
-                  log.debug("Fin.: {}, seed time:{}/{}, ratio: {}, spec. rules = {}, sr cond. = {}/{},isfinished = {}, hash = {}".format(name,seedtime,seedtime_limit,ratio,specific_rules,remove_cond,seed_remove_cond,isFinished,hash))                  
-                  if (not specific_rules) or (seed_remove_cond):                                       
-                    #remove condition
-                    if seedtime > seedtime_limit:                        
-                        #seed_remove_data decides if user wants data removed or not
-                        self.remove_torrent(i, seed_remove_data)
-                        changed = True
-                        log.info("AutoRemovePlus: removing torrent from seed: {} due to seed time = {}/{} h".format(name,seedtime,seedtime_limit))
-                        
-                    #pause condition
-                    elif seedtime > seedtime_pause:
-                        if pause_torrents:
-                            try:
-                                #paused = t.get_status(['paused'])['paused']
-                                if not paused:
-                                  self.pause_torrent(t)
-                                  #changed = True
-                                  log.info("AutoRemovePlus: pausing finished torrent {} with seedtime = {}/{} h, ratio = {}, rules = {}, sr-cond = {}/{}".format(name,seedtime,seedtime_pause,ratio,specific_rules,remove_cond,seed_remove_cond))
-                                else:
-                                  log.debug("AutoRemovePlus: torrent is already paused: {}".format(name))
-                            except Exception as e:
-                                  log.warning("AutoRemovePlus: error with pausing torrent: {}".format(name))
-
-        # If a torrent exemption state has been removed save changes
-        if changed:
-            self.torrent_states.save()
+
+                yield i, s, (remove_cond, seed_remove_cond, specific_rules, rule_str, values)
+
+            if ranking is not None:
+                if max_seeds <= 0:
+                    # every torrent is a candidate
+                    ranking['cutoff'] = (float('-inf'), float('-inf'))
+                else:
+                    # the rest of the selection only matters for the cutoff
+                    for n, candidate in enumerate(candidates):
+                        if candidate is None or (n and not n % SCAN_STEP):
+                            yield None
+                        if candidate is not None:
+                            lowest = candidate[0]
+                    if lowest is not None:
+                        ranking['cutoff'] = (
+                            metrics.get(lowest, self.config['filter']),
+                            metrics.get(lowest, self.config['filter2'])
+                        )
+        finally:
+            timer.add('keys', metrics.seconds, metrics.misses)
+            timer.add('selection', selection[0] - selection[1])
+            log.debug("Metric cache: {} hits, {} misses".format(metrics.hits,metrics.misses))
+
+    def _column_decisions(self, torrents, max_seeds, torrent_rules, general_rule, timer, ranking=None):
+        """Yields (torrent_id, snapshot, decision) like _python_decisions(),
+        but evaluates the general and seed time rules of all candidates at
+        once on columns. Only candidates that may be acted on are yielded,
+        with None after every SCAN_STEP torrents"""
+        min_val = float(self.config['min'])
+        max_val2 = float(self.config['min2'])
+        rule_1_chk = self.config['rule_1_enabled']
+        rule_2_chk = self.config['rule_2_enabled']
+        seedtime_limit = float(self.config['seedtime_limit'])
+        seedtime_pause = float(self.config['seedtime_pause'])
+
+        if ranking is not None:
+            ranking['time'] = time.time()
+        start = timer.clock()
+        table = columns.Columns(torrents)
+        timer.add('columns', timer.clock() - start, len(torrents))
+
+        # Torrents above max_seeds, by primary and secondary criteria,
+        # highest first
+        start = timer.clock()
+        ordered = table.order(self.config['filter'], self.config['filter2'])
+        order = ordered[max_seeds:][::-1]
+        if ranking is not None:
+            if max_seeds <= 0:
+                ranking['cutoff'] = (float('-inf'), float('-inf'))
+            elif max_seeds < len(torrents):
+                lowest = ordered[max_seeds]
+                ranking['cutoff'] = (
+                    table.get(self.config['filter'])[lowest].item(),
+                    table.get(self.config['filter2'])[lowest].item()
+                )
+        timer.add('selection', timer.clock() - start)
+
+        start = timer.clock()
+        filter_1 = table.get(self.config['filter']) <= min_val
+        filter_2 = table.get(self.config['filter2']) >= max_val2
+        if rule_1_chk and rule_2_chk:
+            # If both rules active use custom logical function
+            remove_cond = columns.sel_masks[self.config['sel_func']](filter_1, filter_2)
+        elif rule_1_chk:
+            remove_cond = filter_1
+        elif rule_2_chk:
+            remove_cond = filter_2
+        else:
+            remove_cond = numpy.zeros(len(torrents), dtype=bool)
+
+        # If there are specific rules, ignore general remove rules
+        seed_remove_cond = numpy.zeros(len(torrents), dtype=bool)
+        has_specific = numpy.zeros(len(torrents), dtype=bool)
+        specific = {}
+        for n, index in enumerate(order.tolist()):
+            if n and not n % SCAN_STEP:
+                yield None
+            specific_rules = torrent_rules[torrents[index][0]]
+            if not specific_rules:
+                continue
+            cond = specific_rules.evaluate(lambda func_name: table.get(func_name)[index])
+            remove_cond[index] = seed_remove_cond[index] = bool(cond)
+            has_specific[index] = True
+            specific[index] = (specific_rules, specific_rules.description)
+
+        seedtime = table.get('func_seed_time')
+        act = numpy.where(
+            table.is_finished,
+            (~has_specific | seed_remove_cond) & ((seedtime > seedtime_limit) | (seedtime > seedtime_pause)),
+            remove_cond
+        )
+        acting = order[act[order]]
+        timer.add('masks', timer.clock() - start)
+        log.debug("Columnar scan: {} of {} candidates may be acted on".format(len(acting),len(order)))
+
+        for n, index in enumerate(acting.tolist()):
+            if n and not n % SCAN_STEP:
+                yield None
+            i, s = torrents[index]
+            specific_rules, rule_str = specific.get(index, ([], general_rule))
+            yield i, s, (bool(remove_cond[index]), bool(seed_remove_cond[index]), specific_rules, rule_str, table.row(index))
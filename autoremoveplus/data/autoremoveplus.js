@@ -175,6 +175,39 @@ Deluge.plugins.autoremoveplus.ui.PreferencePage = Ext.extend(Ext.TabPanel, {
               align: 'stretch'
             }
         });
+
+        this.statsBox = this.add({
+            title: 'Statistics',
+            xtype: 'panel',
+            layout: {
+              type: 'vbox',
+              align: 'stretch'
+            }
+        });
+
+        this.scanStatsLabel = this.statsBox.add({
+              xtype: 'label',
+              margins: '5 5 8 5',
+              text: _('No check has run yet.')
+        });
+
+        this.previewContainer = this.statsBox.add({
+              xtype: 'container',
+              layout: 'hbox',
+              margins: '5 5 8 5',
+              items: [{
+                  xtype: 'button',
+                  text: _('Preview next check'),
+                  handler: this.onPreviewScan,
+                  scope: this
+              }]
+        });
+
+        this.previewLabel = this.statsBox.add({
+              xtype: 'label',
+              margins: '5 5 8 5',
+              text: ''
+        });
 		
 		this.mediaPanel = this.mediaSettingsBox.add({
               xtype: 'container',
@@ -1106,7 +1139,55 @@ Deluge.plugins.autoremoveplus.ui.PreferencePage = Ext.extend(Ext.TabPanel, {
         }
     },
 
+    onPreviewScan: function() {
+        deluge.client.autoremoveplus.preview_scan({
+          success: this.loadPreview,
+          scope: this
+        });
+    },
+
+    loadPreview: function(plan) {
+        if (!plan.length) {
+          this.previewLabel.setText(_('Nothing would be paused or removed.'));
+          return;
+        }
+        var reclaimed = 0;
+        var lines = [];
+        Ext.each(plan, function(entry) {
+          reclaimed += entry['reclaimed'];
+          lines.push(String.format('{0} {1}{2}: {3}', entry['action'],
+              Ext.util.Format.htmlEncode(entry['name']),
+              entry['remove_data'] ? _(' with data') : '',
+              Ext.util.Format.htmlEncode(entry['rule'])));
+        });
+        lines.unshift(String.format(_('{0} torrents, {1} reclaimed'), plan.length, fsize(reclaimed)));
+        this.previewLabel.setText(lines.join('<br/>'), false);
+    },
+
+    loadScanStats: function(scans) {
+        if (!scans.length) {
+          this.scanStatsLabel.setText(_('No check has run yet.'));
+          return;
+        }
+        var scan = scans[scans.length - 1];
+        var lines = [String.format(_('Last {0} check at {1}, took {2} s'), scan['kind'],
+            new Date(scan['started'] * 1000).toLocaleString(), scan['duration'].toFixed(3))];
+        Ext.each(scan['phases'], function(phase) {
+          lines.push(String.format('&nbsp;&nbsp;&nbsp;&nbsp;{0}: {1} s ({2} calls)', phase['name'],
+              phase['time'].toFixed(3), phase['calls']));
+        });
+        Ext.each(Object.keys(scan['counts']).sort(), function(name) {
+          lines.push(String.format('&nbsp;&nbsp;&nbsp;&nbsp;{0}: {1}', name, scan['counts'][name]));
+        });
+        this.scanStatsLabel.setText(lines.join('<br/>'), false);
+    },
+
     _loadPrefs1: function() {
+        deluge.client.autoremoveplus.get_scan_stats({
+          success: this.loadScanStats,
+          scope: this
+        });
+
         deluge.client.autoremoveplus.get_config({
           success: function(prefs) {
             this.preferences = prefs;
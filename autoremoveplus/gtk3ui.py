@@ -50,7 +50,7 @@ from deluge.plugins.pluginbase import Gtk3PluginBase
 import deluge.component as component
 # import deluge.common
 
-from autoremoveplus.common import get_resource
+from autoremoveplus.common import get_resource, format_scan_stats
 
 
 #class GtkUI(GtkPluginBase):
@@ -148,6 +148,13 @@ class Gtk3UI(Gtk3PluginBase):
             self.on_click_chk_rule_2
         )
 
+        # Breakdown of the last check, refreshed with the prefs
+        self._lbl_scan_stats = Gtk.Label()
+        self._lbl_scan_stats.set_alignment(0.0, 0.0)
+        self._lbl_scan_stats.set_selectable(True)
+        self.builder.get_object("prefs_box").pack_end(self._lbl_scan_stats, False, False, 0)
+        self._lbl_scan_stats.show()
+
         def on_menu_show(menu, xxx_todo_changeme):
             (menu_item, toggled) = xxx_todo_changeme
             def set_ignored(ignored):
@@ -308,6 +315,10 @@ class Gtk3UI(Gtk3PluginBase):
 
     def on_show_prefs(self):
         client.autoremoveplus.get_config().addCallback(self.cb_get_config)
+        client.autoremoveplus.get_scan_stats().addCallback(self.cb_get_scan_stats)
+
+    def cb_get_scan_stats(self, scans):
+        self._lbl_scan_stats.set_text("\n".join(format_scan_stats(scans)))
 
     def cb_get_rules(self, rules):
         self.rules.clear()
@@ -47,7 +47,7 @@ from deluge.plugins.pluginbase import GtkPluginBase
 import deluge.component as component
 # import deluge.common
 
-from common import get_resource
+from common import get_resource, format_scan_stats
 
 
 class GtkUI(GtkPluginBase):
@@ -144,6 +144,13 @@ class GtkUI(GtkPluginBase):
             self.on_click_chk_rule_2
         )
 
+        # Breakdown of the last check, refreshed with the prefs
+        self._lbl_scan_stats = gtk.Label()
+        self._lbl_scan_stats.set_alignment(0.0, 0.0)
+        self._lbl_scan_stats.set_selectable(True)
+        self.glade.get_widget("prefs_box").pack_end(self._lbl_scan_stats, False, False, 0)
+        self._lbl_scan_stats.show()
+
         def on_menu_show(menu, menu_item_toggled):
             (menu_item, toggled) = menu_item_toggled
             def set_ignored(ignored):
@@ -304,6 +311,10 @@ class GtkUI(GtkPluginBase):
 
     def on_show_prefs(self):
         client.autoremoveplus.get_config().addCallback(self.cb_get_config)
+        client.autoremoveplus.get_scan_stats().addCallback(self.cb_get_scan_stats)
+
+    def cb_get_scan_stats(self, scans):
+        self._lbl_scan_stats.set_text("\n".join(format_scan_stats(scans)))
 
     def cb_get_rules(self, rules):
         self.rules.clear()
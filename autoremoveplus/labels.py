@@ -0,0 +1,71 @@
+from __future__ import unicode_literals
+#
+# labels.py
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class LabelIndex(object):
+    """Labels of a set of torrents, read once from the Label plugin.
+
+    The Label plugin sends no events when labels change, so the index is
+    built again for every scan instead of being kept up to date. Torrents are
+    also indexed by label, to handle all torrents of a label at once.
+    """
+
+    def __init__(self, plugin, torrent_ids):
+        # torrent id -> label, '' for no label
+        self.labels = {}
+        # label -> torrent ids
+        self.by_label = {}
+
+        torrent_labels = getattr(plugin, 'torrent_labels', None)
+        for torrent_id in torrent_ids:
+            if isinstance(torrent_labels, dict):
+                label = torrent_labels.get(torrent_id) or ''
+            else:
+                label = plugin._status_get_label(torrent_id)
+            self.labels[torrent_id] = label
+            self.by_label.setdefault(label, set()).add(torrent_id)
+
+    def get(self, torrent_id, default=''):
+        return self.labels.get(torrent_id, default)
+
+    def exempt_torrents(self, matcher):
+        """Returns the ids of the torrents with a label exempted by matcher"""
+        exempt = set()
+        for label, torrent_ids in self.by_label.items():
+            if matcher.match_label(label)[0]:
+                exempt.update(torrent_ids)
+        return exempt
@@ -0,0 +1,170 @@
+from __future__ import unicode_literals
+#
+# matcher.py
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class RuleChain(object):
+    """Specific rules of a torrent, compiled into a predicate.
+
+    Rules are (operator, filter, minimum) and are combined in order, AND
+    first, each with the result of the rules before it. The order is fixed
+    and the operators resolved once, evaluate() only looks values up.
+    """
+
+    def __init__(self, rules, operators):
+        self.rules = sorted(rules, key=lambda rule: rule[0])
+        steps = []
+        for op, func_name, limit in self.rules:
+            operator = operators.get(op)
+            if operator is None:
+                log.warning("Unknown operator in specific rule: {}".format(op))
+                continue
+            steps.append((operator, func_name, limit))
+        self.steps = tuple(steps)
+        self.description = "specific rules " + ", ".join(
+            "{} {} >= {}".format(rule[0], rule[1], rule[2]) for rule in self.rules
+        )
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __repr__(self):
+        return repr(self.rules)
+
+    def evaluate(self, value):
+        """Returns whether the rules are met, value(filter) returns the
+        value of a filter for the torrent"""
+        if not self.steps:
+            return False
+        _, func_name, limit = self.steps[0]
+        cond = value(func_name) >= limit
+        for operator, func_name, limit in self.steps[1:]:
+            cond = operator((value(func_name) >= limit, cond))
+        return cond
+
+
+class TorrentMatcher(object):
+    """Exemptions and specific rules of the tracker/label config, compiled once
+    per config change.
+
+    match() answers both questions for a torrent in one pass. Tracker results
+    are cached per set of tracker urls, and compiled rule chains per set of
+    tracker urls and label, since most torrents share them with many others.
+    prune() drops the results no torrent used since the last call, full scans
+    call it so the caches do not grow with every torrent ever added.
+    operators maps the rule operators to their functions.
+    """
+
+    def __init__(self, exemp_trackers, exemp_labels, tracker_rules, label_rules, operators):
+        self.exemp_trackers = [tracker.lower() for tracker in exemp_trackers]
+        self.exemp_labels = [label.lower() for label in exemp_labels]
+        self.tracker_rules = [
+            (name.lower(), list(rules)) for name, rules in tracker_rules.items()
+        ]
+        self.label_rules = label_rules
+        self.operators = operators
+        # (tracker urls) -> (exempt, rules)
+        self._tracker_cache = {}
+        # (tracker urls, label) -> (exempt, RuleChain)
+        self._match_cache = {}
+        # keys of _match_cache used since the last prune()
+        self._seen = set()
+
+    def match_trackers(self, urls):
+        """Returns (exempt, rules) for a tuple of tracker urls"""
+        try:
+            return self._tracker_cache[urls]
+        except KeyError:
+            pass
+
+        exempt = False
+        rules = []
+        for url in urls:
+            for ex_tracker in self.exemp_trackers:
+                if ex_tracker in url:
+                    log.debug("Found exempted tracker: %s" % (ex_tracker))
+                    exempt = True
+            for name, tracker_rules in self.tracker_rules:
+                if name in url:
+                    rules.extend(tracker_rules)
+
+        result = self._tracker_cache[urls] = (exempt, rules)
+        return result
+
+    def match_label(self, label):
+        """Returns (exempt, rules) for a label, '' or None for no label"""
+        if not label:
+            return (False, [])
+        exempt = False
+        for ex_label in self.exemp_labels:
+            if ex_label in label:
+                log.debug("Found exempted label: %s" % (ex_label))
+                exempt = True
+        return (exempt, self.label_rules.get(label, []))
+
+    def match(self, trackers, label=None):
+        """Returns (exempt, RuleChain) of a torrent, from its trackers
+        (status 'trackers') and its label, None if labels are not in use"""
+        urls = tuple(tracker['url'] for tracker in trackers or [])
+        key = (urls, label)
+        self._seen.add(key)
+        try:
+            return self._match_cache[key]
+        except KeyError:
+            pass
+
+        tracker_exempt, tracker_rules = self.match_trackers(urls)
+        label_exempt, label_rules = self.match_label(label)
+        result = self._match_cache[key] = (
+            tracker_exempt or label_exempt,
+            RuleChain(tracker_rules + label_rules, self.operators)
+        )
+        return result
+
+    def prune(self):
+        """Drops the cached results not used since the last prune(), so the
+        caches only hold the trackers and labels of current torrents.
+        Returns the number of results dropped"""
+        seen, self._seen = self._seen, set()
+        dropped = len(self._match_cache) - len(seen)
+        self._match_cache = dict(
+            (key, result) for key, result in self._match_cache.items() if key in seen
+        )
+        urls = set(key[0] for key in seen)
+        self._tracker_cache = dict(
+            (key, result) for key, result in self._tracker_cache.items() if key in urls
+        )
+        return dropped
@@ -27,12 +27,22 @@ import io
 import os
 import logging
 import configparser
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
 log = logging.getLogger(__name__)
 
+try:
+    import ijson
+except ImportError:
+    # without ijson queue pages are decoded in full
+    ijson = None
+
 from deluge.plugins.pluginbase import CorePluginBase
 import deluge.component as component
 import deluge.configmanager
 from deluge.core.rpcserver import export
+from twisted.internet import defer, threads
 
 
 httpErrors = {
@@ -107,93 +117,167 @@ class HTTP_MethodError(Exception):
         return repr(self.value)
 
 class Mediaserver(object):
-    def __init__(self, server, apikey, type='sonarr'):
+    def __init__(self, server, apikey, type='sonarr', page_size=250, workers=4, pool_size=10):
         self.server     = server
         self.api_key    = apikey
         self.type       = type
+        self.page_size  = page_size  # records requested per queue page
+        self.workers    = workers    # maximum number of queue pages fetched at once
         self.endpoint       = '/sonarr/api/v3' if type == 'sonarr' else '/lidarr/api/v1' if type == 'lidarr' else '/radarr/api' if type == 'radarr' else None
               
         if self.endpoint is None:
             raise Exception('Unknown server: {}'.format(type))
-        
-        log.info ("Endpoint of {} is {}".format(self.type,self.endpoint))
-
-    def get_queue(self):
-        """ Get queue from server
-        """
 
-        # Create and send HTTP Get to the mediaserver
-        h={
+        # One pooled keep-alive session per server, shared by all requests
+        self.session = requests.Session()
+        self.session.headers.update({
             'http.useragent' : 'Deluge-autoremoveplus',
             'x-api-key'      :  self.api_key,
             'Content-Type'   : 'application/json',
             'User-Agent'     : 'Deluge/Autoremoveplus',
             'Accept-Encoding': 'gzip'
-        }
+        })
+        self.pool_maxsize = None
+        self.set_pool(pool_size)
+        # set to False once the server turns out to have no /queue/bulk
+        self.bulk_delete = True
         
-        pagenum = 1
+        log.info ("Endpoint of {} is {}".format(self.type,self.endpoint))
+
+    def set_pool(self, pool_size):
+        """ Mounts a connection pool of pool_size connections, at least one
+            per worker, unless the current pool already has that size
+        """
+        pool_maxsize = max(pool_size, self.workers)
+        if pool_maxsize == self.pool_maxsize:
+            return
+        old_adapter = self.session.adapters.get('http://') if self.pool_maxsize else None
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.pool_maxsize = pool_maxsize
+        if old_adapter is not None:
+            # idle connections of the old pool are closed, requests still
+            # running on it close theirs when done
+            old_adapter.close()
+        log.debug("Connection pool of {} is {} connections".format(self.type,pool_maxsize))
+
+    def configure(self, page_size, workers, pool_size):
+        """ Applies new paging and pool settings to a live server """
+        self.page_size = page_size
+        self.workers   = workers
+        self.set_pool(pool_size)
+
+    def get_queue(self):
+        """ Get queue from server
+
+            The first page tells the total number of records, the remaining
+            pages are then fetched concurrently by up to self.workers threads.
+        """
         output = {}
-        
-        while True:
+
+        total_records, page_size, page = self._get_queue_page(1)
+        output.update(page)
+
+        if total_records < 0:
+            # no paging on this api, the whole queue is returned at once
+            log.debug("Returning {} records from {} queue".format(len(output),self.type))
+            return output
+
+        # the server may cap the page size, so go by what it reports
+        page_size = page_size or self.page_size
+        pages = int(math.ceil(total_records / float(page_size)))
+        log.debug("Total records {}, page size {}, pages {}".format(total_records,page_size,pages))
+
+        if pages > 1:
+            pool = ThreadPoolExecutor(max_workers=max(1, min(self.workers, pages - 1)))
             try:
-                url = self.server + self.endpoint + '/queue?' +str('page=') + str(pagenum)
-                log.debug("Sending GET request to {}".format(url))
-                r = requests.get(url, headers=h,timeout=30)
-            except Exception as e:
-                raise HTTP_MethodError('Error Connecting to server: {}'.format(e))
-            
+                for total_records, page_size, page in pool.map(self._get_queue_page, range(2, pages + 1)):
+                    output.update(page)
+            finally:
+                pool.shutdown(wait=False)
+
+        log.debug("Returning {} records from {} queue".format(len(output),self.type))
+        return output
+
+    def _get_queue_page(self, pagenum):
+        """ Returns (total records, page size, {downloadId: {'id', 'title'}})
+            for one queue page, total records is -1 if the api has no paging
+        """
+        try:
+            url = self.server + self.endpoint + '/queue?page={}&pageSize={}'.format(pagenum,self.page_size)
+            log.debug("Sending GET request to {}".format(url))
+            r = self.session.get(url, timeout=30, stream=True)
+        except Exception as e:
+            raise HTTP_MethodError('Error Connecting to server: {}'.format(e))
+
+        try:
             log.debug("HTTP {}: {}".format(r.status_code,httpErrors[r.status_code]))
             
             if r.status_code == 200: #200 = 'OK'
-                total_records = r.json()['totalRecords'] if  (self.type == 'lidarr' or self.type == 'sonarr') else -1 # return negative number if no total is available
-                records_left = total_records-pagenum*10
-                log.debug("Page {}, total records {}, left {}".format(pagenum,total_records,records_left))
-                parsedata = (r.json()['records'] if (self.type == 'lidarr' or self.type == 'sonarr') else r.json())
-                try:
-                    for data in parsedata:
-                        output[data.get('downloadId')] = {'id':data.get('id'),'title':data.get('title')}       
-                except Exception as e:
-                    log.error("Invalid mediaserver type: {}, {}".format(self.type,e))
-                if records_left <= 0: break;
-                pagenum += 1
-                
-                if pagenum > 500:
-                    log.warn("Capped at 500 iterations for server {}. Total records reported as {}".format(self.type,total_records))
-                    break;
-                
+                paged = (self.type == 'lidarr' or self.type == 'sonarr')
+                if ijson is not None:
+                    r.raw.decode_content = True
+                    return self._parse_queue_stream(r.raw, paged)
+                return self._parse_queue(r.json(), paged)
             else:
                 raise Exception("Cannot get queue:  {} ({})".format(r.status_code,httpErrors[r.status_code]))
-                
-        log.debug("Returning {} records from {} queue".format(len(output),self.type))
-        return output
+        finally:
+            r.close()
+
+    def _parse_queue(self, data, paged):
+        output = {}
+        try:
+            for record in (data['records'] if paged else data):
+                output[record.get('downloadId')] = {'id':record.get('id'),'title':record.get('title')}
+        except Exception as e:
+            log.error("Invalid mediaserver type: {}, {}".format(self.type,e))
+        return (data['totalRecords'] if paged else -1, data.get('pageSize') if paged else None, output)
+
+    def _parse_queue_stream(self, stream, paged):
+        """ Same as _parse_queue, but only picks downloadId, id and title out
+            of the response instead of decoding every record in full
+        """
+        prefix = 'records.item' if paged else 'item'
+        fields = {prefix + '.downloadId': 'downloadId', prefix + '.id': 'id', prefix + '.title': 'title'}
+        total_records = -1
+        page_size = None
+        output = {}
+        record = None
+        for path, event, value in ijson.parse(stream):
+            if path == prefix:
+                if event == 'start_map':
+                    record = {}
+                elif event == 'end_map':
+                    output[record.get('downloadId')] = {'id':record.get('id'),'title':record.get('title')}
+                    record = None
+            elif record is not None and path in fields:
+                record[fields[path]] = value
+            elif paged and path == 'totalRecords':
+                total_records = value
+            elif paged and path == 'pageSize':
+                page_size = value
+        return (total_records, page_size, output)
                
     def get_blacklist(self):
         """ Get blacklist from server
             
         """
-        
-        # Create and send HTTP Get to the mediaserver
-        h={
-            'http.useragent' : 'Deluge-autoremoveplus',
-            'x-api-key'      :  self.api_key,
-            'Content-Type'   : 'application/json',
-            'User-Agent'     : 'Deluge/Autoremoveplus',
-            'Accept-Encoding': 'gzip'
-        }
 
         url = self.server + self.endpoint + '/blacklist?sortkey=date'
 
         log.debug("Sending GET request to {}: type = {}".format(url,type(url)))
         
         try:
-            r = requests.get(url, headers=h,timeout=30)
+            r = self.session.get(url, timeout=30)
         except Exception as e:
             raise HTTP_MethodError('Error Connecting to server: {}'.format(e))
         
         log.debug ("HTTP {}: {}".format(r.status_code,httpErrors[r.status_code]))
         
         if r.status_code == 200: #200 = 'OK'
-            output = r.json().get('records') if r.json().get('records') else r.json()
+            data = r.json()
+            output = data.get('records') if isinstance(data, dict) and data.get('records') else data
             return output
         else:
             log.error("Error getting blacklist for {}: {}".format(self.type,r.status_code))
@@ -204,20 +288,12 @@ class Mediaserver(object):
             
         """
         
-        # Create and send HTTP Delete to the mediaserver
-        h={ #For some reason header update doesnt work
-            'http.useragent' : 'Deluge-autoremoveplus',
-            'x-api-key'      :  self.api_key,
-            'Content-Type'   : 'application/json',
-            'User-Agent'     : 'Deluge/Autoremoveplus',
-            'Accept-Encoding': 'gzip'
-        }
         query = str(item_id)
         url = self.server + self.endpoint + '/blacklist/'+ query
         log.debug("Sending DELETE request to {}: type = {}".format(url,type(url)))
         
         try:
-            r = requests.delete(url, headers=h,timeout=30)
+            r = self.session.delete(url, timeout=30)
         except Exception as e:
             raise HTTP_MethodError('Error Connecting to server: {}'.format(e))
         
@@ -232,15 +308,6 @@ class Mediaserver(object):
     def delete_queueitem(self,item_id,blacklist = 'true',removeFromClient = 'false'):
         """ delete queue item from server
         """
-        
-        # Create and send HTTP Delete request to the mediaserver
-        h={
-            'http.useragent' : 'Deluge-autoremoveplus',
-            'x-api-key'      :  self.api_key,
-            'Content-Type'   : 'application/json',
-            'User-Agent'     : 'Deluge/Autoremoveplus',
-            'Accept-Encoding': 'gzip'
-        }
         log.debug("Parsing item id: {}, type = {}".format(item_id,type(item_id)))
         try:
             query = str(item_id)+'?blacklist='+str(blacklist)+'&removeFromClient='+str(removeFromClient)
@@ -252,7 +319,7 @@ class Mediaserver(object):
         log.debug("Sending DELETE request to {}: type = {}".format(url,type(url)))
         
         try:
-            r = requests.delete(url, headers=h,timeout=30)
+            r = self.session.delete(url, timeout=30)
         except Exception as e:
             raise HTTP_MethodError('Error Connecting to server: {}'.format(e))
         
@@ -270,7 +337,133 @@ class Mediaserver(object):
             log.error("Unable to delete item {}, query = {}, url = {}, response = {}".format(item_id,query,url,r.status_code))
             return False
 
+    def delete_queueitems(self,item_ids,blacklist = 'true',removeFromClient = 'false',chunk_size = 100):
+        """ delete several queue items from server, returns the ids that were deleted
+
+            Uses the bulk endpoint in chunks of chunk_size ids, servers without
+            it get one request per item.
+        """
+        item_ids = [str(item_id) for item_id in item_ids]
+        deleted = []
+
+        while item_ids and self.bulk_delete:
+            chunk, item_ids = item_ids[:chunk_size], item_ids[chunk_size:]
+            url = self.server + self.endpoint + '/queue/bulk?blacklist='+str(blacklist)+'&removeFromClient='+str(removeFromClient)
+            log.debug("Sending bulk DELETE request to {} for {} items".format(url,len(chunk)))
+
+            try:
+                r = self.session.delete(url, json={'ids': [int(item_id) for item_id in chunk]}, timeout=30)
+            except Exception as e:
+                raise HTTP_MethodError('Error Connecting to server: {}'.format(e))
+
+            log.debug ("HTTP {}: {}".format(r.status_code,httpErrors[r.status_code]))
+
+            if r.status_code == 200: #200 = 'OK'
+                deleted.extend(chunk)
+            elif r.status_code in (404, 405):
+                # older api without bulk delete, do this chunk and the rest one by one
+                log.info("No bulk delete on {}, deleting items one by one".format(self.type))
+                self.bulk_delete = False
+                item_ids = chunk + item_ids
+            else:
+                log.error("Unable to delete {} items from {}: {} ({})".format(len(chunk),self.type,r.status_code,httpErrors[r.status_code]))
+
+        for item_id in item_ids:
+            try:
+                if self.delete_queueitem(item_id, blacklist, removeFromClient) is not False:
+                    deleted.append(item_id)
+            except HTTP_MethodError as e:
+                log.error("Unable to delete item {} from {}: {}".format(item_id,self.type,e))
+
+        return deleted
+
+
+class AsyncMediaserver(object):
+    """ Non-blocking front end of Mediaserver for use inside the deluge daemon.
+        Every call runs in the reactor thread pool and returns a Deferred, so
+        a slow server never stalls the reactor.
+
+        The queue is cached for queue_ttl seconds and shared by all callers,
+        items deleted through this object are dropped from the cached copy.
+    """
+    def __init__(self, server, apikey, type='sonarr', queue_ttl=60, page_size=250, workers=4, pool_size=10):
+        self.mediaserver = Mediaserver(server, apikey, type, page_size, workers, pool_size)
+        self.type        = type
+        self.queue_ttl   = queue_ttl
+        self._queue      = None
+        self._queue_time = 0
+        self._waiting    = None  # Deferreds waiting for a running queue fetch
+
+    def get_queue(self):
+        if self._queue is not None and time.time() - self._queue_time < self.queue_ttl:
+            log.debug("Using cached {} queue ({} records)".format(self.type,len(self._queue)))
+            return defer.succeed(self._queue)
+
+        d = defer.Deferred()
+        if self._waiting is not None:
+            # a fetch is already running, share its result
+            self._waiting.append(d)
+            return d
+        self._waiting = [d]
+
+        def fetched(queue):
+            self._queue      = queue
+            self._queue_time = time.time()
+            waiting, self._waiting = self._waiting, None
+            for w in waiting:
+                w.callback(queue)
+
+        def failed(failure):
+            waiting, self._waiting = self._waiting, None
+            for w in waiting:
+                w.errback(failure)
+
+        threads.deferToThread(self.mediaserver.get_queue).addCallbacks(fetched, failed)
+        return d
+
+    def configure(self, queue_ttl, page_size, workers, pool_size):
+        self.queue_ttl = queue_ttl
+        self.mediaserver.configure(page_size, workers, pool_size)
+
+    def invalidate_queue(self):
+        self._queue = None
+
+    def queue_fetched(self):
+        """Time the cached queue was fetched, 0 if there is none"""
+        return self._queue_time if self._queue is not None else 0
+
+    def _drop_queueitems(self, item_ids):
+        if self._queue is None:
+            return
+        item_ids = set(str(item_id) for item_id in item_ids)
+        for download_id, item in list(self._queue.items()):
+            if str(item.get('id')) in item_ids:
+                del self._queue[download_id]
+
+    def get_blacklist(self):
+        return threads.deferToThread(self.mediaserver.get_blacklist)
+
+    def delete_blacklist_item(self, item_id):
+        return threads.deferToThread(self.mediaserver.delete_blacklist_item, item_id)
+
+    def delete_queueitem(self, item_id, blacklist = 'true', removeFromClient = 'false'):
+        def deleted(response):
+            if response is not False:
+                self._drop_queueitems([item_id])
+            return response
+
+        d = threads.deferToThread(self.mediaserver.delete_queueitem, item_id, blacklist, removeFromClient)
+        d.addCallback(deleted)
+        return d
+
+    def delete_queueitems(self, item_ids, blacklist = 'true', removeFromClient = 'false'):
+        def deleted(item_ids):
+            self._drop_queueitems(item_ids)
+            return item_ids
 
+        d = threads.deferToThread(self.mediaserver.delete_queueitems, item_ids, blacklist, removeFromClient)
+        d.addCallback(deleted)
+        return d
 
 def main(server,mode='queue',item=None):
     log.info("Server = {}, mode = {}, item = {}".format(server,mode,item))
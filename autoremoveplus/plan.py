@@ -0,0 +1,119 @@
+from __future__ import unicode_literals
+#
+# plan.py
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class ScanPlan(object):
+    """What a scan decided to do, before anything is done.
+
+    Every entry is a dict with the torrent_id, name, action ('pause',
+    'remove' or 'blacklist'), remove_data, server (for blacklist), the rule
+    that triggered it, the metric values it was decided on and the bytes it
+    reclaims. The entries are grouped the way the actions are executed:
+    pauses, removals per remove_data and blacklist targets per server.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.pauses = []
+        # remove_data -> torrent ids
+        self.removals = {True: [], False: []}
+        # server type -> (torrent_id, hash, name, is_finished, remove_data)
+        self.targets = {}
+
+    def pause(self, i, s, rule, metrics=None):
+        self.add({
+            'torrent_id': i,
+            'name': s['name'],
+            'action': 'pause',
+            'remove_data': False,
+            'server': None,
+            'rule': rule,
+            'metrics': metrics or {},
+            'reclaimed': 0,
+            'hash': s['hash'].upper(),
+            'is_finished': s['is_finished']
+        })
+
+    def remove(self, i, s, remove_data, rule, metrics=None, action='remove', server=None):
+        self.add({
+            'torrent_id': i,
+            'name': s['name'],
+            'action': action,
+            'remove_data': remove_data,
+            'server': server,
+            'rule': rule,
+            'metrics': metrics or {},
+            'reclaimed': (s.get('total_size') or 0) if remove_data else 0,
+            'hash': s['hash'].upper(),
+            'is_finished': s['is_finished']
+        })
+
+    def blacklist(self, server, i, s, remove_data, rule, metrics=None):
+        self.remove(i, s, remove_data, rule, metrics, 'blacklist', server)
+
+    def add(self, entry):
+        self.entries.append(entry)
+        i = entry['torrent_id']
+        if entry['action'] == 'pause':
+            self.pauses.append(i)
+        elif entry['action'] == 'remove':
+            self.removals[entry['remove_data']].append(i)
+        else:
+            self.targets.setdefault(entry['server'], []).append(
+                (i, entry['hash'], entry['name'], entry['is_finished'], entry['remove_data'])
+            )
+
+    def restrict(self, torrent_ids):
+        """Returns the plan for the torrents in torrent_ids only"""
+        plan = ScanPlan()
+        for entry in self.entries:
+            if entry['torrent_id'] in torrent_ids:
+                plan.add(entry)
+        return plan
+
+    def log(self):
+        for entry in self.entries:
+            log.info("AutoRemovePlus: {} torrent {}{}: {}".format(
+                entry['action'],
+                entry['name'],
+                ' with data' if entry['remove_data'] else '',
+                entry['rule']
+            ))
+
+    def __len__(self):
+        return len(self.entries)
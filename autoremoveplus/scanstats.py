@@ -0,0 +1,148 @@
+from __future__ import unicode_literals
+#
+# scanstats.py
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+from collections import deque
+import time
+
+import logging
+log = logging.getLogger(__name__)
+
+# number of scans kept by ScanStats
+HISTORY_SIZE = 20
+
+
+class ScanTimer(object):
+    """Wall time and number of calls of each phase of one scan, plus plain
+    counters (torrents, status calls, removals...).
+
+    Phases that run in a Deferred are measured with timed(), so their time
+    is the time until the Deferred fires, not the time spent on the reactor.
+    Phases that yield to the reactor in between are measured with clock(),
+    which leaves out the idle time.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.started = time.time()
+        self.finished = None
+        # phase name -> [seconds, calls], in the order phases first ran
+        self.phases = {}
+        self.order = []
+        self.counts = {}
+        # seconds spent waiting on the reactor between chunks of work
+        self.idle = 0.0
+
+    def clock(self):
+        """Returns the current time less the idle time so far, differences
+        of clock() are the time spent working"""
+        return time.time() - self.idle
+
+    def add(self, phase, seconds, calls=1):
+        try:
+            entry = self.phases[phase]
+        except KeyError:
+            entry = self.phases[phase] = [0.0, 0]
+            self.order.append(phase)
+        entry[0] += seconds
+        entry[1] += calls
+
+    def phase(self, phase):
+        """Returns a context manager timing the code in its block as phase"""
+        return _Phase(self, phase)
+
+    def timed(self, d, phase):
+        """Times Deferred d as phase, from now until it fires"""
+        start = time.time()
+
+        def done(result):
+            self.add(phase, time.time() - start)
+            return result
+
+        return d.addBoth(done)
+
+    def total(self):
+        """Seconds recorded over all phases so far"""
+        return sum(entry[0] for entry in self.phases.values())
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def as_dict(self):
+        finished = self.finished or time.time()
+        return {
+            'kind': self.kind,
+            'started': self.started,
+            'duration': finished - self.started,
+            'idle': self.idle,
+            'phases': [
+                {'name': phase, 'time': self.phases[phase][0], 'calls': self.phases[phase][1]}
+                for phase in self.order
+            ],
+            'counts': dict(self.counts)
+        }
+
+
+class _Phase(object):
+
+    def __init__(self, timer, phase):
+        self.timer = timer
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = self.timer.clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.add(self.phase, self.timer.clock() - self.start)
+        return False
+
+
+class ScanStats(object):
+    """Ring buffer of the timings of the last scans"""
+
+    def __init__(self, size=HISTORY_SIZE):
+        self.scans = deque(maxlen=size)
+
+    def record(self, timer):
+        timer.finished = time.time()
+        scan = timer.as_dict()
+        self.scans.append(scan)
+        log.debug("Scan took {:.3f} s: {}".format(
+            scan['duration'],
+            ", ".join("{} {:.3f} s".format(p['name'], p['time']) for p in scan['phases'])
+        ))
+
+    def get(self):
+        """Returns the recorded scans, oldest first"""
+        return list(self.scans)
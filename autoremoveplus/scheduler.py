@@ -0,0 +1,159 @@
+from __future__ import unicode_literals
+#
+# scheduler.py
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+from twisted.internet import defer, reactor
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class ScanScheduler(object):
+    """Runs scans one at a time.
+
+    request() starts a scan right away when none is running. Requests made
+    while a scan runs are coalesced into a single pending scan, started when
+    the running one finishes. The pending scan is a full scan if any of the
+    requests was for one. request_later() debounces requests: each call
+    pushes the scan back by delay seconds, so a burst of calls runs one scan.
+    run_exclusive() runs other work that acts on torrents in between scans,
+    never at the same time as one.
+
+    run(incremental, counts) runs a scan and returns a Deferred, counts has
+    how many requests the scan stands in for: 'coalesced' requests made
+    while a scan was running and 'skipped' debounced requests.
+    """
+
+    def __init__(self, run):
+        self.run = run
+        # Deferreds waiting on the running scan or action, None when idle
+        self.running = None
+        # incremental flag of the pending scan, None when there is none
+        self.pending = None
+        self.pending_waiters = []
+        # (func, args, Deferred) of the work waiting for the running scan
+        self.actions = []
+        # counts of the next scan started
+        self.counts = {}
+        self.delayed_call = None
+        # requests debounced into the delayed scan
+        self.skipped = 0
+        self.stopped = False
+
+    def count(self, name):
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def request(self, incremental=False):
+        """Returns a Deferred firing with the result of the scan covering
+        this request"""
+        d = defer.Deferred()
+        if self.stopped:
+            d.callback(None)
+        elif self.running is None:
+            self.running = [d]
+            self._start(incremental)
+        else:
+            if self.pending is None:
+                log.debug("Check running, the next one starts when it is done")
+                self.pending = incremental
+            else:
+                self.pending = self.pending and incremental
+                self.count('coalesced')
+            self.pending_waiters.append(d)
+        return d
+
+    def request_later(self, delay, incremental=False):
+        """Requests a scan once no other request_later() came in for delay
+        seconds"""
+        if self.stopped:
+            return
+        if self.delayed_call and self.delayed_call.active():
+            self.delayed_call.reset(delay)
+            self.skipped += 1
+        else:
+            self.delayed_call = reactor.callLater(delay, self._request_delayed, incremental)
+
+    def _request_delayed(self, incremental):
+        # the skipped requests go to the scan covering the delayed one
+        if self.skipped:
+            self.counts['skipped'] = self.counts.get('skipped', 0) + self.skipped
+            self.skipped = 0
+        return self.request(incremental)
+
+    def run_exclusive(self, func, *args):
+        """Returns a Deferred firing with the result of func(*args), called
+        once no scan is running. Pending scans wait for it"""
+        d = defer.Deferred()
+        if self.stopped:
+            d.callback(None)
+        elif self.running is None:
+            self.running = [d]
+            self._call(func, *args)
+        else:
+            log.debug("Check running, acting on torrents when it is done")
+            self.actions.append((func, args, d))
+        return d
+
+    def stop(self):
+        """Drops the pending and delayed scans, and refuses new requests.
+        The running scan is left to finish"""
+        self.stopped = True
+        if self.delayed_call and self.delayed_call.active():
+            self.delayed_call.cancel()
+        self.skipped = 0
+        self.pending = None
+        waiters, self.pending_waiters = self.pending_waiters, []
+        actions, self.actions = self.actions, []
+        for d in waiters + [d for func, args, d in actions]:
+            d.callback(None)
+
+    def _start(self, incremental):
+        counts, self.counts = self.counts, {}
+        self._call(self.run, incremental, counts)
+
+    def _call(self, func, *args):
+        d = defer.maybeDeferred(func, *args)
+        d.addBoth(self._finished)
+
+    def _finished(self, result):
+        waiters, self.running = self.running, None
+        if self.actions:
+            func, args, d = self.actions.pop(0)
+            self.running = [d]
+            self._call(func, *args)
+        elif self.pending is not None:
+            self.running, self.pending_waiters = self.pending_waiters, []
+            incremental, self.pending = self.pending, None
+            self._start(incremental)
+        for d in waiters:
+            d.callback(result)
@@ -0,0 +1,188 @@
+from __future__ import unicode_literals
+#
+# statestore.py
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import json
+import logging
+import os
+import tempfile
+import threading
+
+import deluge.configmanager
+from deluge.config import find_json_objects
+from twisted.internet import reactor, threads
+
+log = logging.getLogger(__name__)
+
+
+def _write_file(filename, torrent_ids):
+    """Writes torrent_ids one per line to a temporary file next to filename
+    and moves it over filename, so a crash never leaves a half written file"""
+    dirname = os.path.dirname(filename)
+    with tempfile.NamedTemporaryFile(
+        'w', dir=dirname, prefix=os.path.basename(filename) + '.', delete=False
+    ) as _file:
+        tmp_filename = _file.name
+        _file.write(''.join(torrent_id + '\n' for torrent_id in sorted(torrent_ids)))
+        _file.flush()
+        os.fsync(_file.fileno())
+    os.replace(tmp_filename, filename)
+
+
+def _read_legacy_states(filename):
+    """Returns the ignored torrent ids of an autoremoveplusstates.conf file,
+    a deluge config of torrent_id -> bool"""
+    with open(filename) as _file:
+        data = _file.read()
+    start, end = find_json_objects(data)[-1]
+    return set(
+        torrent_id for torrent_id, ignored in json.loads(data[start:end]).items() if ignored
+    )
+
+
+class StateStore(object):
+    """Ids of the torrents ignored by the user, written behind.
+
+    Only ignored torrents are stored, one id per line. Changes only mark
+    the store dirty, save() schedules one write after delay seconds however
+    many changes come in meanwhile. The file is written in a thread with a
+    copy of the ids taken on the reactor thread. flush() writes pending
+    changes right away, for disable().
+    """
+
+    def __init__(self, filename, legacy_filename=None, delay=2.0):
+        self.filename = deluge.configmanager.get_config_dir(filename)
+        self.delay = delay
+        self.dirty = False
+        self.save_call = None
+        # writes are numbered so an older write never replaces a newer one
+        self.write_lock = threading.Lock()
+        self.write_seq = 0
+        self.written_seq = 0
+        self.ignored = self.load()
+        if legacy_filename:
+            self.migrate(deluge.configmanager.get_config_dir(legacy_filename))
+
+    def load(self):
+        try:
+            with open(self.filename) as _file:
+                return set(line.strip() for line in _file if line.strip())
+        except (IOError, OSError):
+            return set()
+
+    def migrate(self, legacy_filename):
+        """Imports the ignored torrents of the old states file once, then
+        moves it out of the way"""
+        if not os.path.isfile(legacy_filename):
+            return
+        try:
+            ignored = _read_legacy_states(legacy_filename)
+        except (IOError, OSError, IndexError, ValueError) as e:
+            log.error("Unable to read torrent states from {}: {}".format(legacy_filename, e))
+            return
+        log.info("Migrating {} ignored torrents from {}".format(len(ignored), legacy_filename))
+        self.ignored.update(ignored)
+        self.dirty = True
+        self.flush()
+        os.rename(legacy_filename, legacy_filename + '.bak')
+
+    def get(self, torrent_id, default=False):
+        return torrent_id in self.ignored or default
+
+    def __contains__(self, torrent_id):
+        return torrent_id in self.ignored
+
+    def __len__(self):
+        return len(self.ignored)
+
+    def __setitem__(self, torrent_id, ignored):
+        if ignored and torrent_id not in self.ignored:
+            self.ignored.add(torrent_id)
+            self.dirty = True
+        elif not ignored and torrent_id in self.ignored:
+            self.ignored.discard(torrent_id)
+            self.dirty = True
+
+    def pop(self, torrent_id, default=None):
+        if torrent_id in self.ignored:
+            self.ignored.discard(torrent_id)
+            self.dirty = True
+            return True
+        return default
+
+    def prune(self, torrent_ids):
+        """Forgets the torrents that are not in torrent_ids, returns how many"""
+        orphans = self.ignored.difference(torrent_ids)
+        if orphans:
+            self.ignored.difference_update(orphans)
+            self.dirty = True
+        return len(orphans)
+
+    def save(self):
+        """Schedules a write of the ignored torrents, if they changed"""
+        if not self.dirty or (self.save_call and self.save_call.active()):
+            return
+        self.save_call = reactor.callLater(self.delay, self._save)
+
+    def _save(self):
+        self.save_call = None
+        seq, torrent_ids = self._take()
+        d = threads.deferToThread(self._write, seq, torrent_ids)
+        d.addErrback(self._save_failed)
+        return d
+
+    def flush(self):
+        """Writes pending changes now, on the calling thread"""
+        if self.save_call and self.save_call.active():
+            self.save_call.cancel()
+        self.save_call = None
+        if self.dirty:
+            self._write(*self._take())
+
+    def _take(self):
+        self.dirty = False
+        self.write_seq += 1
+        return self.write_seq, list(self.ignored)
+
+    def _write(self, seq, torrent_ids):
+        with self.write_lock:
+            if seq < self.written_seq:
+                return
+            _write_file(self.filename, torrent_ids)
+            self.written_seq = seq
+            log.debug("Saved {} ignored torrents".format(len(torrent_ids)))
+
+    def _save_failed(self, failure):
+        log.error("Unable to save ignored torrents: {}".format(failure.getErrorMessage()))
+        # try again with the next save
+        self.dirty = True
@@ -0,0 +1,159 @@
+#
+# arr_server.py
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+"""A local HTTP stand-in for the Sonarr, Radarr and Lidarr queue API, with
+tunable latency, counting the requests and connections it gets.
+"""
+
+import json
+import re
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    raise SystemExit("The benchmarks need python 3.7 or later")
+
+
+class ArrServer(object):
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        # server type -> queue records
+        self.queues = {'sonarr': [], 'radarr': [], 'lidarr': []}
+        self.lock = threading.Lock()
+        self.reset_counters()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), _handler(self))
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.httpd.server_address[1]
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_counters(self):
+        self.counters = {'requests': 0, 'gets': 0, 'deletes': 0, 'connections': 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def set_queue(self, server_type, torrent_ids, filler=0):
+        """Queues torrent_ids on server_type, plus filler unrelated items"""
+        records = [
+            {'id': n + 1, 'downloadId': torrent_id.upper(), 'title': 'item %d' % n}
+            for n, torrent_id in enumerate(torrent_ids)
+        ]
+        records.extend(
+            {'id': len(records) + n + 1, 'downloadId': 'F%039X' % n, 'title': 'filler %d' % n}
+            for n in range(filler)
+        )
+        self.queues[server_type] = records
+
+    def delete(self, server_type, ids):
+        ids = set(ids)
+        with self.lock:
+            self.queues[server_type] = [r for r in self.queues[server_type] if r['id'] not in ids]
+
+
+def _handler(server):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def setup(self):
+            BaseHTTPRequestHandler.setup(self)
+            server.count('connections')
+
+        def _send(self, code, obj):
+            body = json.dumps(obj).encode('utf8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _begin(self, counter):
+            if server.latency:
+                time.sleep(server.latency)
+            server.count('requests')
+            server.count(counter)
+            url = urlparse(self.path)
+            return url, url.path.split('/')[1], parse_qs(url.query)
+
+        def do_GET(self):
+            url, server_type, query = self._begin('gets')
+            records = server.queues.get(server_type, [])
+            if url.path.endswith('/queue'):
+                if server_type == 'radarr':
+                    return self._send(200, records)
+                page = int(query.get('page', ['1'])[0])
+                size = int(query.get('pageSize', ['10'])[0])
+                return self._send(200, {
+                    'page': page,
+                    'pageSize': size,
+                    'totalRecords': len(records),
+                    'records': records[(page - 1) * size:page * size]
+                })
+            if url.path.endswith('/blacklist'):
+                return self._send(200, {'records': []})
+            self._send(404, {})
+
+        def do_DELETE(self):
+            url, server_type, query = self._begin('deletes')
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+            if url.path.endswith('/queue/bulk'):
+                server.delete(server_type, json.loads(body.decode('utf8'))['ids'])
+                return self._send(200, {})
+            match = re.search(r'/queue/(\d+)$', url.path)
+            if match:
+                server.delete(server_type, [int(match.group(1))])
+                return self._send(200, {})
+            self._send(404, {})
+
+    return Handler
@@ -0,0 +1,211 @@
+#
+# bench_scan.py
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+"""Benchmarks a full and an incremental scan of Core against synthetic
+torrents and a local media server stand-in.
+
+    python benchmarks/bench_scan.py --sizes 1000,10000,100000
+
+Reports, for every number of torrents, the wall time of both scans, the
+status calls, HTTP requests and connections they made, the torrents they
+removed and the peak memory traced while they ran.
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import deluge.configmanager
+from twisted.internet import defer, task
+
+from fakes import LABELS, TRACKERS, install, make_torrents
+from arr_server import ArrServer
+
+GIB = 1073741824.0
+SERVER_LABELS = {'sonarr': 'tv-sonarr', 'radarr': 'radarr', 'lidarr': 'lidarr'}
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='comma separated numbers of torrents')
+    parser.add_argument('--keep', type=float, default=0.9,
+                        help='max_seeds as a fraction of the torrents')
+    parser.add_argument('--trackers', type=int, default=len(TRACKERS),
+                        help='number of distinct trackers')
+    parser.add_argument('--labels', default=','.join(LABELS),
+                        help='comma separated labels to pick from')
+    parser.add_argument('--max-age', type=float, default=60.0,
+                        help='oldest torrent, in days')
+    parser.add_argument('--max-ratio', type=float, default=5.0)
+    parser.add_argument('--max-seed-time', type=float, default=500.0,
+                        help='longest seed time, in hours')
+    parser.add_argument('--min-age', type=float, default=7.0,
+                        help='age in days above which torrents are removed')
+    parser.add_argument('--free-space', type=float, default=-1.0,
+                        help='hdd_space in GiB, -1 to ignore free space')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='media server latency per request, in seconds')
+    parser.add_argument('--queue-size', type=int, default=1000,
+                        help='unrelated items in every media server queue')
+    parser.add_argument('--changed', type=float, default=0.01,
+                        help='fraction of torrents changed before the incremental scan')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='do not trace memory, tracing slows the scans down')
+    parser.add_argument('--phases', action='store_true',
+                        help='print the phase breakdown of every scan')
+    parser.add_argument('--log-level', default='error',
+                        help='log level of the plugin while benchmarking')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args(argv)
+
+
+def make_config(count, args, server):
+    return {
+        'enabled': True,
+        'max_seeds': int(count * args.keep),
+        'filter': 'func_ratio',
+        'min': args.max_ratio,
+        'filter2': 'func_added',
+        'min2': args.min_age,
+        'sel_func': 'and',
+        'rule_1_enabled': True,
+        'rule_2_enabled': True,
+        'hdd_space': args.free_space,
+        'remove': True,
+        'pause_torrents': True,
+        'server_url': server.url,
+        'api_sonarr': 'bench',
+        'api_radarr': 'bench',
+        'api_lidarr': 'bench',
+        'enable_sonarr': True,
+        'enable_radarr': True,
+        'enable_lidarr': True
+    }
+
+
+@defer.inlineCallbacks
+def run(count, args, server):
+    from autoremoveplus.core import Core, DEFAULT_PREFS
+
+    trackers = ['http://tracker%d.example.org/announce' % n for n in range(args.trackers)]
+    manager, label = make_torrents(
+        count, trackers=trackers, labels=args.labels.split(','), max_age=args.max_age,
+        max_ratio=args.max_ratio, max_seed_time=args.max_seed_time, seed=args.seed
+    )
+    components = install(manager, label, 0.0)
+    for server_type, name in SERVER_LABELS.items():
+        queued = [i for i in manager.torrents if label.labels[i] == name]
+        server.set_queue(server_type, queued, args.queue_size)
+    server.reset_counters()
+
+    config = deluge.configmanager.ConfigManager('autoremoveplus.conf', DEFAULT_PREFS)
+    config.config.update(make_config(count, args, server))
+    core = Core('AutoRemovePlus')
+    core.enable()
+    try:
+        if not args.no_memory:
+            tracemalloc.start()
+
+        start = time.time()
+        yield core.periodicScan()
+        full_time = time.time() - start
+        full_calls = manager.status_calls
+
+        rng = random.Random(args.seed)
+        torrent_ids = manager.get_torrent_list()
+        for torrent_id in rng.sample(torrent_ids, int(len(torrent_ids) * args.changed)):
+            core.on_torrent_changed(torrent_id)
+        start = time.time()
+        yield core.tick()
+        tick_time = time.time() - start
+
+        peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+    finally:
+        tracemalloc.stop()
+        core.disable()
+
+    return {
+        'torrents': count,
+        'full': full_time,
+        'incremental': tick_time,
+        'status_calls': full_calls,
+        'incremental_status_calls': manager.status_calls - full_calls,
+        'free_space_calls': components['Core'].free_space_calls,
+        'requests': server.counters['requests'],
+        'connections': server.counters['connections'],
+        'removed': manager.removed,
+        'peak': peak,
+        'scans': core.get_scan_stats()
+    }
+
+
+def print_phases(result):
+    for scan in result['scans']:
+        print("  {} scan, {:.3f} s".format(scan['kind'], scan['duration']))
+        for phase in scan['phases']:
+            print("    {:<12} {:>9.3f} s {:>8} calls".format(phase['name'], phase['time'], phase['calls']))
+
+
+@defer.inlineCallbacks
+def main(reactor, argv):
+    args = parse_args(argv)
+    logging.basicConfig(level=getattr(logging, args.log_level.upper()))
+    deluge.configmanager.set_config_dir(tempfile.mkdtemp(prefix='autoremoveplus-bench-'))
+    server = ArrServer(args.latency).start()
+
+    columns = ('torrents', 'full s', 'incr s', 'status', 'incr stat', 'statvfs', 'http', 'conns', 'removed', 'peak MiB')
+    print(("{:>10}" * len(columns)).format(*columns))
+    try:
+        for count in [int(size) for size in args.sizes.split(',')]:
+            result = yield run(count, args, server)
+            print(("{:>10}{:>10.3f}{:>10.3f}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10.1f}").format(
+                result['torrents'], result['full'], result['incremental'], result['status_calls'],
+                result['incremental_status_calls'], result['free_space_calls'], result['requests'],
+                result['connections'], result['removed'], result['peak'] / 1048576.0
+            ))
+            if args.phases:
+                print_phases(result)
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    task.react(main, (sys.argv[1:],))
@@ -0,0 +1,189 @@
+#
+# fakes.py
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+#   The Free Software Foundation, Inc.,
+#   51 Franklin Street, Fifth Floor
+#   Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+"""Stand-ins for the deluge components Core talks to, so a scan can run
+without a deluge daemon. install() makes deluge.component.get() return them.
+"""
+
+import random
+import time
+
+import deluge.component as component
+from twisted.internet import defer
+
+TRACKERS = ['http://tracker.example.org/announce', 'udp://open.example.com:80', 'https://private.example.net/ann']
+LABELS = ['', 'tv-sonarr', 'radarr', 'lidarr', 'keep']
+
+
+class FakeTorrent(object):
+
+    def __init__(self, manager, torrent_id, status):
+        self.manager = manager
+        self.torrent_id = torrent_id
+        self.status = status
+
+    def get_status(self, keys, diff=False, update=False, all_keys=False):
+        self.manager.status_calls += 1
+        return dict((key, self.status[key]) for key in keys)
+
+    def pause(self):
+        self.status['paused'] = True
+        self.status['state'] = 'Paused'
+        return True
+
+
+class FakeTorrentManager(object):
+
+    def __init__(self):
+        self.torrents = {}
+        self.status_calls = 0
+        self.removed = 0
+
+    def get_state(self):
+        return 'Started'
+
+    def get_torrent_list(self):
+        return list(self.torrents)
+
+    def __getitem__(self, torrent_id):
+        return self.torrents[torrent_id]
+
+    def remove(self, torrent_id, remove_data=False, save_state=True):
+        del self.torrents[torrent_id]
+        self.removed += 1
+        return True
+
+
+class FakeLabel(object):
+
+    def __init__(self):
+        self.labels = {}
+
+    def _status_get_label(self, torrent_id):
+        return self.labels.get(torrent_id, '')
+
+
+class FakePluginManager(object):
+
+    def get_enabled_plugins(self):
+        return ['Label', 'AutoRemovePlus']
+
+
+class FakeCore(object):
+    """The parts of deluge's Core the plugin uses, free space is the same
+    for every path"""
+
+    def __init__(self, manager, free_space):
+        self.manager = manager
+        self.free_space = free_space
+        self.free_space_calls = 0
+
+    def get_free_space(self, path=None):
+        self.free_space_calls += 1
+        return self.free_space
+
+    def remove_torrents(self, torrent_ids, remove_data):
+        for torrent_id in torrent_ids:
+            self.manager.remove(torrent_id, remove_data, save_state=False)
+        return defer.succeed([])
+
+    def pause_torrents(self, torrent_ids):
+        for torrent_id in torrent_ids:
+            self.manager[torrent_id].pause()
+
+
+class FakeEventManager(object):
+
+    def register_event_handler(self, event, handler):
+        pass
+
+    def deregister_event_handler(self, event, handler):
+        pass
+
+
+class FakeRPCServer(object):
+
+    def register_object(self, obj, name=None):
+        pass
+
+    def deregister_object(self, obj):
+        pass
+
+
+def make_torrents(count, trackers=TRACKERS, labels=LABELS, max_age=60.0,
+                  max_ratio=5.0, max_seed_time=500.0, seed=1):
+    """Returns a FakeTorrentManager and FakeLabel with count torrents.
+
+    Ages are spread up to max_age days, ratios up to max_ratio and seed
+    times up to max_seed_time hours."""
+    rng = random.Random(seed)
+    now = time.time()
+    manager = FakeTorrentManager()
+    label = FakeLabel()
+    for n in range(count):
+        torrent_id = '%040x' % rng.getrandbits(160)
+        finished = rng.random() < 0.8
+        manager.torrents[torrent_id] = FakeTorrent(manager, torrent_id, {
+            'name': 'torrent %d' % n,
+            'hash': torrent_id,
+            'ratio': rng.random() * max_ratio,
+            'time_added': now - rng.random() * max_age * 86400.0,
+            'seeding_time': rng.random() * max_seed_time * 3600.0 if finished else 0,
+            'total_seeds': rng.randint(0, 100),
+            'distributed_copies': rng.random() * 10.0,
+            'time_since_transfer': rng.random() * 72 * 3600.0,
+            'last_seen_complete': now - rng.random() * 72 * 3600.0,
+            'is_finished': finished,
+            'paused': False,
+            'state': 'Seeding' if finished else 'Downloading',
+            'total_size': rng.randint(1, 50) * 2 ** 28,
+            'save_path': '/downloads',
+            'trackers': [{'url': rng.choice(trackers)}]
+        })
+        label.labels[torrent_id] = rng.choice(labels)
+    return manager, label
+
+
+def install(manager, label, free_space):
+    """Makes deluge.component.get() return the fakes, returns them by name"""
+    components = {
+        'TorrentManager': manager,
+        'CorePlugin.Label': label,
+        'CorePluginManager': FakePluginManager(),
+        'Core': FakeCore(manager, free_space),
+        'EventManager': FakeEventManager(),
+        'RPCServer': FakeRPCServer()
+    }
+    component._ComponentRegistry.components.clear()
+    component.get = lambda name: components[name]
+    return components